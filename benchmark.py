@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+File Sorter Benchmark
+Generates parametrized file corpora and times the sorters on them
+"""
+
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from typing import Callable, Dict, List, Tuple
+import argparse
+from datetime import datetime
+
+from demo_files import DEMO_FILES
+import file_sorter
+import file_sorter_safe
+
+# Format version of the JSON report
+REPORT_VERSION = 1
+
+# File size distributions: (weight, min bytes, max bytes) buckets
+SIZE_DISTRIBUTIONS = {
+    'empty': [(1.0, 0, 0)],
+    'small': [(1.0, 1, 4 * 1024)],
+    'mixed': [(0.70, 1, 16 * 1024),
+              (0.25, 16 * 1024, 1024 * 1024),
+              (0.05, 1024 * 1024, 16 * 1024 * 1024)],
+    'large': [(1.0, 1024 * 1024, 64 * 1024 * 1024)],
+}
+
+# Data written into generated files, in slices
+_FILL = b'\0' * (1024 * 1024)
+
+# Corpus parameters; see the command line help for each field
+CorpusSpec = namedtuple('CorpusSpec', ['files', 'depth', 'fanout', 'sizes',
+                                       'extensions', 'collision_rate', 'seed'])
+
+
+def parse_extension_mix(text: str) -> List[Tuple[str, float]]:
+    """Parse an extension mix like '.jpg:5,.pdf:2,.txt'
+    
+    'demo' uses the extensions of the demo files, equally weighted. An
+    empty extension ('' or ':3') produces files without one.
+    """
+    if text == 'demo':
+        return [(file_sorter.split_name(name)[1], 1.0) for name in DEMO_FILES]
+    
+    mix = []
+    for item in text.split(','):
+        extension, _, weight = item.partition(':')
+        extension = extension.strip()
+        if extension and not extension.startswith('.'):
+            extension = '.' + extension
+        mix.append((extension, float(weight) if weight else 1.0))
+    return mix
+
+
+def generate_corpus(root: str, spec: CorpusSpec) -> Dict:
+    """Create a corpus under root/source and return a description of it
+    
+    Files are spread at random over a directory tree depth levels deep
+    with fanout subdirectories per level (depth 0 puts everything at the
+    top). A collision_rate fraction of files also get a same-named file
+    placed in their category folder in root/target beforehand, so sorting
+    them has to pick a new name.
+    """
+    rng = random.Random(spec.seed)
+    source = os.path.join(root, 'source')
+    target = os.path.join(root, 'target')
+    os.makedirs(source)
+    os.makedirs(target)
+    
+    directories = [source]
+    level = [source]
+    for depth in range(spec.depth):
+        next_level = []
+        for parent in level:
+            for index in range(spec.fanout):
+                path = os.path.join(parent, f'd{depth}_{index}')
+                os.mkdir(path)
+                next_level.append(path)
+        directories.extend(next_level)
+        level = next_level
+    
+    extensions = [extension for extension, _ in spec.extensions]
+    extension_weights = [weight for _, weight in spec.extensions]
+    buckets = SIZE_DISTRIBUTIONS[spec.sizes]
+    bucket_weights = [weight for weight, _, _ in buckets]
+    
+    classifier = file_sorter.FileSorter(source, target, quiet=True)
+    total_bytes = 0
+    collisions = 0
+    top_level = 0
+    
+    for number in range(spec.files):
+        extension = rng.choices(extensions, extension_weights)[0]
+        name = f'file_{number:07d}{extension}'
+        _, low, high = rng.choices(buckets, bucket_weights)[0]
+        size = rng.randint(low, high)
+        
+        directory = rng.choice(directories)
+        _write_file(os.path.join(directory, name), size)
+        total_bytes += size
+        if directory == source:
+            top_level += 1
+        
+        if rng.random() < spec.collision_rate:
+            folder = os.path.join(target, classifier.get_category_for_name(name))
+            os.makedirs(folder, exist_ok=True)
+            _write_file(os.path.join(folder, name), 0)
+            collisions += 1
+    
+    return {
+        'source': source,
+        'target': target,
+        'directories': len(directories),
+        'top_level_files': top_level,
+        'bytes': total_bytes,
+        'collisions': collisions,
+    }
+
+
+def _write_file(path: str, size: int) -> None:
+    with open(path, 'wb') as f:
+        while size > 0:
+            chunk = _FILL[:size]
+            f.write(chunk)
+            size -= len(chunk)
+
+
+def _run_sort_files(source: str, target: str) -> Dict:
+    sorter = file_sorter.FileSorter(source, target, quiet=True)
+    sorter.sort_files()
+    return sorter.stats
+
+
+def _run_sort_files_recursive(source: str, target: str) -> Dict:
+    sorter = file_sorter.FileSorter(source, target, quiet=True)
+    sorter.sort_files_recursive()
+    return sorter.stats
+
+
+def _run_list_file_types(source: str, target: str) -> Dict:
+    sorter = file_sorter.FileSorter(source, target, quiet=True)
+    sorter.list_file_types()
+    return sorter.stats
+
+
+def _run_safe_sort_files(source: str, target: str) -> Dict:
+    sorter = file_sorter_safe.FileSorter(source, target)
+    sorter.sort_files()
+    return sorter.stats
+
+
+def _run_safe_list_file_types(source: str, target: str) -> Dict:
+    sorter = file_sorter_safe.FileSorter(source, target)
+    sorter.list_file_types()
+    return sorter.stats
+
+
+# Benchmarks by name: the function to time, whether it changes the corpus
+# (and so needs a fresh one for every run), and whether it walks the whole
+# tree or only the top-level files
+BENCHMARKS = {
+    'sort_files': (_run_sort_files, True, False),
+    'sort_files_recursive': (_run_sort_files_recursive, True, True),
+    'list_file_types': (_run_list_file_types, False, False),
+    'safe_sort_files': (_run_safe_sort_files, True, False),
+    'safe_list_file_types': (_run_safe_list_file_types, False, False),
+}
+
+
+def run_benchmark(name: str, spec: CorpusSpec, repeat: int, base_dir: str = None) -> Dict:
+    """Time one benchmark over repeat runs, each on a freshly built corpus
+    
+    Output the sorters print goes to os.devnull, so its formatting cost is
+    measured but no terminal is involved. Corpus generation is not timed.
+    """
+    function, mutates, recursive = BENCHMARKS[name]
+    times = []
+    corpus = None
+    stats = {}
+    root = None
+    
+    try:
+        for _ in range(repeat):
+            if root is None or mutates:
+                if root is not None:
+                    shutil.rmtree(root)
+                root = tempfile.mkdtemp(prefix='file_sorter_bench_', dir=base_dir)
+                corpus = generate_corpus(root, spec)
+            
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                started = time.perf_counter()
+                stats = function(corpus['source'], corpus['target'])
+                times.append(time.perf_counter() - started)
+    finally:
+        if root is not None:
+            shutil.rmtree(root, ignore_errors=True)
+    
+    best = min(times)
+    files = spec.files if recursive else corpus['top_level_files']
+    return {
+        'name': name,
+        'files': files,
+        'runs': times,
+        'min': best,
+        'median': statistics.median(times),
+        'files_per_sec': files / best if best else None,
+        'moved': stats.get('moved', 0),
+        'errors': stats.get('errors', 0),
+        'corpus': {key: corpus[key] for key in ('directories', 'top_level_files', 'bytes', 'collisions')},
+    }
+
+
+def run_benchmarks(names: List[str], spec: CorpusSpec, repeat: int,
+                   base_dir: str = None, progress: Callable[[str], None] = None) -> Dict:
+    """Run several benchmarks and return the full JSON-ready report"""
+    params = dict(spec._asdict(), repeat=repeat)
+    params['extensions'] = {}
+    for extension, weight in spec.extensions:
+        params['extensions'][extension] = params['extensions'].get(extension, 0) + weight
+    
+    results = []
+    for name in names:
+        if progress is not None:
+            progress(name)
+        results.append(run_benchmark(name, spec, repeat, base_dir))
+    
+    return {
+        'version': REPORT_VERSION,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'filesystem': base_dir or tempfile.gettempdir(),
+        'params': params,
+        'results': results,
+    }
+
+
+def main():
+    """Command line interface"""
+    parser = argparse.ArgumentParser(
+        description='Benchmark the file sorters on generated corpora',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python benchmark.py                                  # 10,000 small files, all benchmarks
+  python benchmark.py -n 100000 --depth 3 --sizes mixed --collision-rate 0.1
+  python benchmark.py --extensions '.jpg:5,.pdf:2,:1' --output bench.json
+  python benchmark.py --tmpdir /dev/shm -b sort_files -b safe_sort_files
+        """
+    )
+    
+    parser.add_argument('--files', '-n',
+                       type=int, default=10000,
+                       help='Number of files in each corpus (default: 10000)')
+    
+    parser.add_argument('--depth',
+                       type=int, default=0,
+                       help='Directory levels below the source to spread files over (default: 0)')
+    
+    parser.add_argument('--fanout',
+                       type=int, default=4,
+                       help='Subdirectories per directory when --depth is set (default: 4)')
+    
+    parser.add_argument('--sizes',
+                       choices=sorted(SIZE_DISTRIBUTIONS), default='small',
+                       help='File size distribution (default: small, 1 byte to 4 KiB)')
+    
+    parser.add_argument('--extensions',
+                       default='demo',
+                       help="Extension mix as '.ext:weight,...', or 'demo' for the demo file types (default)")
+    
+    parser.add_argument('--collision-rate',
+                       type=float, default=0.0,
+                       help='Fraction of files whose name is already taken in the target (default: 0)')
+    
+    parser.add_argument('--seed',
+                       type=int, default=0,
+                       help='Random seed, so corpora are the same between runs (default: 0)')
+    
+    parser.add_argument('--repeat', '-r',
+                       type=int, default=3,
+                       help='Timed runs per benchmark (default: 3)')
+    
+    parser.add_argument('--benchmark', '-b',
+                       action='append', choices=sorted(BENCHMARKS), dest='benchmarks',
+                       help='Benchmark to run; repeatable (default: all)')
+    
+    parser.add_argument('--tmpdir',
+                       help='Directory to build corpora in, e.g. /dev/shm (default: system temp dir)')
+    
+    parser.add_argument('--output', '-o',
+                       help='Write the JSON report to this file instead of stdout')
+    
+    args = parser.parse_args()
+    
+    if args.files < 1 or args.depth < 0 or args.fanout < 1 or args.repeat < 1:
+        parser.error('--files, --fanout and --repeat must be positive and --depth not negative')
+    if not 0.0 <= args.collision_rate <= 1.0:
+        parser.error('--collision-rate must be between 0 and 1')
+    try:
+        extensions = parse_extension_mix(args.extensions)
+    except ValueError as e:
+        parser.error(f'--extensions: {e}')
+    
+    spec = CorpusSpec(args.files, args.depth, args.fanout, args.sizes,
+                      extensions, args.collision_rate, args.seed)
+    names = args.benchmarks or list(BENCHMARKS)
+    
+    report = run_benchmarks(names, spec, args.repeat, args.tmpdir,
+                            progress=lambda name: print(f"Running {name}...", file=sys.stderr))
+    
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"Wrote results to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,68 +7,70 @@ Creates sample files for testing the file sorter
 import os
 from pathlib import Path
 
+# Sample file names, one or more per category (also used by benchmark.py)
+DEMO_FILES = [
+    # Images
+    'vacation_photo.jpg',
+    'screenshot.png',
+    'logo.svg',
+    'profile_pic.gif',
+    
+    # Documents
+    'report.pdf',
+    'notes.txt',
+    'presentation.docx',
+    'manual.rtf',
+    
+    # Spreadsheets
+    'budget.xlsx',
+    'data.csv',
+    'inventory.ods',
+    
+    # Videos
+    'movie.mp4',
+    'tutorial.avi',
+    'clip.mov',
+    
+    # Audio
+    'song.mp3',
+    'podcast.wav',
+    'sound_effect.flac',
+    
+    # Archives
+    'backup.zip',
+    'files.tar.gz',
+    'package.rar',
+    
+    # Code
+    'script.py',
+    'webpage.html',
+    'styles.css',
+    'app.js',
+    
+    # Executables
+    'installer.exe',
+    'program.msi',
+    
+    # Fonts
+    'custom_font.ttf',
+    'web_font.woff',
+    
+    # Misc
+    'readme.md',
+    'config.json',
+    'database.db',
+    'unknown_file',  # File without extension
+]
+
+
 def create_demo_files():
     """Create sample files for testing the file sorter"""
     
-    demo_files = [
-        # Images
-        'vacation_photo.jpg',
-        'screenshot.png',
-        'logo.svg',
-        'profile_pic.gif',
-        
-        # Documents
-        'report.pdf',
-        'notes.txt',
-        'presentation.docx',
-        'manual.rtf',
-        
-        # Spreadsheets
-        'budget.xlsx',
-        'data.csv',
-        'inventory.ods',
-        
-        # Videos
-        'movie.mp4',
-        'tutorial.avi',
-        'clip.mov',
-        
-        # Audio
-        'song.mp3',
-        'podcast.wav',
-        'sound_effect.flac',
-        
-        # Archives
-        'backup.zip',
-        'files.tar.gz',
-        'package.rar',
-        
-        # Code
-        'script.py',
-        'webpage.html',
-        'styles.css',
-        'app.js',
-        
-        # Executables
-        'installer.exe',
-        'program.msi',
-        
-        # Fonts
-        'custom_font.ttf',
-        'web_font.woff',
-        
-        # Misc
-        'readme.md',
-        'config.json',
-        'database.db',
-        'unknown_file',  # File without extension
-    ]
-    
     print("Creating demo files for testing...")
     print("-" * 40)
     
     created_count = 0
-    for filename in demo_files:
+    for filename in DEMO_FILES:
         file_path = Path(filename)
         
         # Don't overwrite existing files
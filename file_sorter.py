@@ -4,19 +4,1556 @@ Automatic File Sorter
 Organizes files into folders based on their extensions
 """
 
+import ctypes
+import ctypes.util
+import errno
+import fnmatch
+import gzip
+import hashlib
+import json
+import mmap
 import os
+import pstats
+import re
+import select
+import signal
 import shutil
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from pathlib import Path
-from typing import Dict, List, Set
+from typing import Callable, Dict, Iterable, Iterator, List, Set, Tuple
 import argparse
 from datetime import datetime
 
+# How often a streaming run reports its running file count
+STREAM_PROGRESS_INTERVAL = 1000
+
+# Default number of concurrent moves allowed on any one device (st_dev)
+DEFAULT_DEVICE_LIMIT = 4
+
+# Chunk size for os.copy_file_range in cross-device moves (8 MiB)
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+# errnos from os.link meaning the filesystem cannot hard-link the file
+# (FAT, some network filesystems, link count exhausted); no-clobber renames
+# then claim the name with O_EXCL and rename over the claim instead
+NO_LINK_ERRNOS = {errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOSYS, errno.EMLINK}
+
+# Linux renameat2(): the flag that makes it fail with EEXIST instead of
+# replacing the destination, and errnos meaning the kernel or filesystem
+# does not support it (no-clobber renames then use a hard link instead)
+RENAME_NOREPLACE = 1
+AT_FDCWD = -100
+NO_RENAMEAT2_ERRNOS = {errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTSUP}
+
+# Suffix of the hidden name a cross-device copy is written under before it
+# is linked to its final name, so a partial copy never sits at that name
+COPY_TEMP_SUFFIX = '.file_sorter-partial'
+
+# Format version written in the header line of move plan files
+PLAN_VERSION = 1
+
+# Journal records written between fsyncs
+JOURNAL_SYNC_EVERY = 256
+
+# Bytes of undo records buffered before each append to the undo log, and
+# the longest a buffered record waits while moves keep coming
+UNDO_BUFFER_SIZE = 64 * 1024
+UNDO_FLUSH_INTERVAL = 1.0
+
+# Default scan index file name, created in the target directory
+INDEX_FILE_NAME = '.file_sorter_index.sqlite'
+
+# Watch mode: seconds a file must stay quiet before it is sorted, and the
+# polling interval (also the longest wait between inotify checks)
+WATCH_DEBOUNCE = 2.0
+WATCH_INTERVAL = 1.0
+
+# Bytes read from the start of a file when sniffing its content type
+SNIFF_BYTES = 512
+
+# Extensions that say nothing about the content; with sniffing enabled,
+# files with these (or with no extension) are classified by magic bytes
+AMBIGUOUS_EXTENSIONS = {'.bin', '.dat', '.data', '.download', '.crdownload', '.part', '.file'}
+
+# Magic-byte signatures as (offset, bytes, category), first match wins
+MAGIC_SIGNATURES = [
+    (0, b'\x89PNG\r\n\x1a\n', 'Images'),
+    (0, b'\xff\xd8\xff', 'Images'),
+    (0, b'GIF87a', 'Images'),
+    (0, b'GIF89a', 'Images'),
+    (0, b'II*\x00', 'Images'),
+    (0, b'MM\x00*', 'Images'),
+    (8, b'WEBP', 'Images'),
+    (0, b'%PDF-', 'Documents'),
+    (0, b'{\\rtf', 'Documents'),
+    (8, b'AVI ', 'Videos'),
+    # ISO-BMFF: the major brand after 'ftyp' tells HEIF/AVIF images and
+    # M4A audio apart from MP4/MOV video
+    (4, b'ftypheic', 'Images'),
+    (4, b'ftypheix', 'Images'),
+    (4, b'ftypmif1', 'Images'),
+    (4, b'ftypavif', 'Images'),
+    (4, b'ftypM4A ', 'Audio'),
+    (4, b'ftypM4B ', 'Audio'),
+    (4, b'ftyp', 'Videos'),
+    (0, b'\x1aE\xdf\xa3', 'Videos'),
+    (0, b'ID3', 'Audio'),
+    (0, b'fLaC', 'Audio'),
+    (0, b'OggS', 'Audio'),
+    (8, b'WAVE', 'Audio'),
+    (0, b'PK\x03\x04', 'Archives'),
+    (0, b'Rar!\x1a\x07', 'Archives'),
+    (0, b"7z\xbc\xaf'\x1c", 'Archives'),
+    (0, b'\x1f\x8b', 'Archives'),
+    (0, b'BZh', 'Archives'),
+    (0, b'\xfd7zXZ\x00', 'Archives'),
+    (257, b'ustar', 'Archives'),
+    (0, b'\x7fELF', 'Executables'),
+    (0, b'MZ', 'Executables'),
+    (0, b'wOFF', 'Fonts'),
+    (0, b'wOF2', 'Fonts'),
+    (0, b'OTTO', 'Fonts'),
+]
+
+# Dedup: bytes hashed from each end of a file before any full hash, what
+# can be done with a duplicate, and the folder quarantined duplicates go to
+DEDUP_SAMPLE_SIZE = 64 * 1024
+DEDUP_MODES = ('skip', 'hardlink', 'quarantine')
+DUPLICATES_FOLDER = 'Duplicates'
+
+# Hidden file left in category folders named after an unknown extension
+# (MD, JSON, ...), so later recursive runs know the sorter made them
+CATEGORY_MARKER = '.file_sorter_category'
+
+# Sharded layouts under each category folder: the available layouts, the
+# default entry limit per shard folder and the name prefix length used by
+# the 'prefix' layout
+SHARD_LAYOUTS = ('date', 'prefix', 'hash')
+SHARD_MAX_ENTRIES = 10000
+SHARD_PREFIX_LENGTH = 2
+
+# ConsoleReporter writes its buffered lines once this many have built up,
+# or once this many seconds have passed since the last write
+REPORT_BUFFER_LINES = 256
+REPORT_FLUSH_INTERVAL = 0.5
+
+# Seconds between redraws of the ProgressReporter status line, and the
+# write buffer size of its per-file log
+PROGRESS_INTERVAL = 0.5
+LOG_BUFFER_SIZE = 1024 * 1024
+
+# Functions listed in the --profile hot-path summary by default
+PROFILE_TOP = 20
+
+# Move strategies, as reported in print_summary
+MOVE_STRATEGIES = {
+    'rename': 'rename without replacing (same device)',
+    'copy': 'copy + unlink (cross device)',
+    'hardlink': 'hard link to duplicate (dedup)',
+}
+
+
+class ScanEntry:
+    """A file found by the scanner, backed by an os.DirEntry
+    
+    Name and type information come straight from the directory listing, so
+    building an entry costs no extra syscall. stat() is only called the first
+    time size or mtime is requested, and the result is cached. Stats that
+    reach the filesystem are counted in metrics, if given.
+    """
+    
+    __slots__ = ('path', 'name', '_entry', '_stat', '_metrics')
+    
+    def __init__(self, entry: os.DirEntry, metrics: 'PhaseMetrics' = None):
+        self.path = entry.path
+        self.name = entry.name
+        self._entry = entry
+        self._stat = None
+        self._metrics = metrics
+    
+    @classmethod
+    def from_path(cls, path: str, metrics: 'PhaseMetrics' = None) -> 'ScanEntry':
+        """Build an entry for a path that did not come from a directory listing"""
+        self = cls.__new__(cls)
+        self.path = path
+        self.name = os.path.basename(path)
+        self._entry = None
+        self._stat = None
+        self._metrics = metrics
+        return self
+    
+    @property
+    def suffix(self) -> str:
+        """File extension, with the same rules as Path.suffix"""
+        return split_name(self.name)[1]
+    
+    def stat(self) -> os.stat_result:
+        """Return the (cached) stat result for this file"""
+        if self._stat is None:
+            if self._metrics is not None:
+                self._metrics.syscall('stat')
+            self._stat = self._entry.stat() if self._entry is not None else os.stat(self.path)
+        return self._stat
+    
+    @property
+    def size(self) -> int:
+        return self.stat().st_size
+    
+    @property
+    def mtime(self) -> float:
+        return self.stat().st_mtime
+    
+    def to_path(self) -> Path:
+        return Path(self.path)
+
+
+# One planned move: absolute source and destination paths, category, bytes
+MoveOp = namedtuple('MoveOp', ['source', 'destination', 'category', 'size'])
+
+
+# Outcome of one file: absolute source and destination paths (for a
+# duplicate, the original it matches), category, one of RESULT_STATUSES and,
+# for moved and linked files when the reporter asks for them, the bytes
+MoveResult = namedtuple('MoveResult', ['source', 'destination', 'category', 'status', 'size'])
+MoveResult.__new__.__defaults__ = (None,)
+
+RESULT_STATUSES = ('moved', 'failed', 'linked', 'duplicate', 'would_move', 'would_link')
+
+
+class Reporter:
+    """Receives a FileSorter's progress and results; this base ignores them
+    
+    Used as is for quiet runs, so handling a file costs no formatting and
+    no I/O. Subclasses override the calls they want to show.
+    """
+    
+    # Sharded workers only report per file when the parent's reporter does
+    verbose = False
+    
+    # Whether results for moved files should carry their size
+    needs_sizes = False
+    
+    def message(self, text: str) -> None:
+        """A status line: run headers, notices"""
+    
+    def result(self, record: MoveResult) -> None:
+        """One file has been handled"""
+    
+    def error(self, source: str, error: Exception) -> None:
+        """A move failed; may be called from move worker threads"""
+    
+    def summary(self, sorter: 'FileSorter') -> None:
+        """The run is complete"""
+    
+    def flush(self) -> None:
+        """Write out anything buffered"""
+    
+    def close(self) -> None:
+        """Flush and release any files; called once the sorter is done"""
+        self.flush()
+
+
+class ConsoleReporter(Reporter):
+    """The classic line-per-file console output, buffered
+    
+    Lines are collected and written with a single call once
+    REPORT_BUFFER_LINES have built up or REPORT_FLUSH_INTERVAL has passed,
+    instead of one print per file. Paths are shown relative to root, which
+    FileSorter sets to its source directory.
+    """
+    
+    verbose = True
+    
+    _VERBS = {'moved': 'Moved', 'linked': 'Linked',
+              'would_move': 'Would move', 'would_link': 'Would link'}
+    
+    def __init__(self, stream=None, root: str = None):
+        self.stream = stream
+        self.root = root
+        self._lines = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _relative(self, path: str) -> str:
+        if self.root and path.startswith(self.root + os.sep):
+            return path[len(self.root) + 1:]
+        return path
+    
+    def _add(self, line: str) -> None:
+        with self._lock:
+            self._lines.append(line)
+            if (len(self._lines) < REPORT_BUFFER_LINES
+                    and time.monotonic() - self._last_flush < REPORT_FLUSH_INTERVAL):
+                return
+        self.flush()
+    
+    def message(self, text: str) -> None:
+        self._add(text)
+        self.flush()
+    
+    def result(self, record: MoveResult) -> None:
+        status = record.status
+        if status == 'failed':
+            # Already reported through error()
+            return
+        if status == 'duplicate':
+            self._add(f"Duplicate: {self._relative(record.source)} "
+                      f"(same as {self._relative(record.destination)})")
+        else:
+            self._add(f"{self._VERBS[status]}: {self._relative(record.source)} → {record.category}/")
+    
+    def error(self, source: str, error: Exception) -> None:
+        self._add(f"Error moving {os.path.basename(source)}: {error}")
+    
+    def summary(self, sorter: 'FileSorter') -> None:
+        self.flush()
+        sorter.print_summary()
+    
+    def flush(self) -> None:
+        with self._lock:
+            lines, self._lines = self._lines, []
+            self._last_flush = time.monotonic()
+            if lines:
+                stream = self.stream or sys.stdout
+                stream.write('\n'.join(lines) + '\n')
+                stream.flush()
+
+
+class ProgressReporter(Reporter):
+    """One status line, redrawn in place, instead of a line per file
+    
+    Results are only counted. From the first result on, a timer thread
+    redraws the line every PROGRESS_INTERVAL seconds with files handled,
+    failures, files/s and MB/s (bytes come from the sizes carried by the
+    results), so it keeps moving during a long copy. Off a terminal it is
+    written as a new line each interval. With log_path set, the full
+    per-file output is appended to that file by a buffered ConsoleReporter.
+    """
+    
+    needs_sizes = True
+    
+    def __init__(self, stream=None, log_path: str = None, interval: float = PROGRESS_INTERVAL):
+        self.stream = stream or sys.stdout
+        self.interval = interval
+        self.counts = {}
+        self.files = 0
+        self.bytes = 0
+        self._started = time.monotonic()
+        self._width = 0
+        self._finished = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._timer = None
+        try:
+            self._tty = self.stream.isatty()
+        except (AttributeError, ValueError):
+            self._tty = False
+        
+        self.log = None
+        if log_path:
+            self.log = ConsoleReporter(open(log_path, 'a', encoding='utf-8', buffering=LOG_BUFFER_SIZE))
+    
+    @property
+    def root(self):
+        return self.log.root if self.log is not None else None
+    
+    @root.setter
+    def root(self, value):
+        if self.log is not None:
+            self.log.root = value
+    
+    def status_line(self) -> str:
+        """The current status: counts and throughput since the reporter started"""
+        elapsed = max(time.monotonic() - self._started, 1e-6)
+        counts = self.counts
+        done = counts.get('moved', 0) + counts.get('linked', 0)
+        parts = [f"{self.files:,} files", f"{done:,} moved"]
+        planned = counts.get('would_move', 0) + counts.get('would_link', 0)
+        if planned:
+            parts[1] = f"{planned:,} planned"
+        if counts.get('failed'):
+            parts.append(f"{counts['failed']:,} failed")
+        if counts.get('duplicate'):
+            parts.append(f"{counts['duplicate']:,} duplicates")
+        parts.append(f"{self.files / elapsed:,.0f} files/s")
+        parts.append(f"{self.bytes / elapsed / (1024 * 1024):,.1f} MB/s")
+        parts.append(f"{int(elapsed) // 60}:{int(elapsed) % 60:02d}")
+        return ' | '.join(parts)
+    
+    def _draw(self) -> None:
+        line = self.status_line()
+        if self._tty:
+            self.stream.write('\r' + line.ljust(self._width))
+            self._width = len(line)
+        else:
+            self.stream.write(line + '\n')
+        self.stream.flush()
+    
+    def _redraw(self) -> None:
+        """Timer thread: redraw the line every interval until finished"""
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                if not self._finished:
+                    self._draw()
+    
+    def _clear(self) -> None:
+        if self._tty and self._width:
+            self.stream.write('\r' + ' ' * self._width + '\r')
+            self._width = 0
+    
+    def message(self, text: str) -> None:
+        with self._lock:
+            self._clear()
+            self.stream.write(text + '\n')
+            if self.files:
+                self._draw()
+            else:
+                self.stream.flush()
+        if self.log is not None:
+            self.log.message(text)
+    
+    def result(self, record: MoveResult) -> None:
+        status = record.status
+        self.counts[status] = self.counts.get(status, 0) + 1
+        self.files += 1
+        if record.size and (status == 'moved' or status == 'linked'):
+            self.bytes += record.size
+        if self.log is not None:
+            self.log.result(record)
+        if self._timer is None:
+            with self._lock:
+                self._draw()
+            self._timer = threading.Thread(target=self._redraw, daemon=True)
+            self._timer.start()
+    
+    def error(self, source: str, error: Exception) -> None:
+        with self._lock:
+            self._clear()
+            self.stream.write(f"Error moving {os.path.basename(source)}: {error}\n")
+        if self.log is not None:
+            self.log.error(source, error)
+    
+    def _finish(self) -> None:
+        """Stop the timer, draw the final status line and leave it in place"""
+        self._stop.set()
+        if self._timer is not None:
+            self._timer.join()
+        with self._lock:
+            if self._finished or not self.files:
+                return
+            self._finished = True
+            self._draw()
+            if self._tty:
+                self.stream.write('\n')
+                self._width = 0
+    
+    def summary(self, sorter: 'FileSorter') -> None:
+        self._finish()
+        self.flush()
+        sorter.print_summary()
+    
+    def flush(self) -> None:
+        self.stream.flush()
+        if self.log is not None:
+            self.log.flush()
+    
+    def close(self) -> None:
+        self._finish()
+        self.flush()
+        if self.log is not None:
+            self.log.stream.close()
+            self.log = None
+
+
+class PhaseMetrics:
+    """Per-phase timers and syscall counters for a FileSorter
+    
+    Phases are scan (directory walk and skip checks), classify, mkdir,
+    collision (name resolution, including registry seeding) and move.
+    Time is summed per phase, so with move threads the move time is the
+    total across threads, not wall time. Syscall counts are kept where the
+    sorter makes the call itself; the scanners hand the metrics to each
+    ScanEntry, which counts the stats it makes.
+    """
+    
+    PHASES = ('scan', 'classify', 'mkdir', 'collision', 'move')
+    
+    def __init__(self):
+        self.seconds = dict.fromkeys(self.PHASES, 0.0)
+        self.calls = dict.fromkeys(self.PHASES, 0)
+        self.syscalls = {}
+        self._lock = threading.Lock()
+    
+    def add(self, phase: str, seconds: float, calls: int = 1) -> None:
+        """Record time spent in a phase"""
+        with self._lock:
+            self.seconds[phase] += seconds
+            self.calls[phase] += calls
+    
+    def syscall(self, name: str, count: int = 1) -> None:
+        """Count system calls made by the sorter"""
+        with self._lock:
+            self.syscalls[name] = self.syscalls.get(name, 0) + count
+    
+    def timed(self, phase: str, iterable: Iterable) -> Iterator:
+        """Yield from iterable, charging the time spent producing each item to phase"""
+        clock = time.perf_counter
+        iterator = iter(iterable)
+        while True:
+            started = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(phase, clock() - started, 0)
+                return
+            self.add(phase, clock() - started)
+            yield item
+    
+    def merge(self, other: Dict) -> None:
+        """Add metrics from to_dict() of another sorter (e.g. a shard worker)"""
+        with self._lock:
+            for phase, values in other['phases'].items():
+                self.seconds[phase] += values['seconds']
+                self.calls[phase] += values['calls']
+            for name, count in other['syscalls'].items():
+                self.syscalls[name] = self.syscalls.get(name, 0) + count
+    
+    def snapshot_syscalls(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.syscalls)
+    
+    def to_dict(self, stats: Dict = None) -> Dict:
+        """Metrics as a JSON-ready dict, with the sorter's counters if given"""
+        data = {
+            'phases': {phase: {'seconds': self.seconds[phase], 'calls': self.calls[phase]}
+                       for phase in self.PHASES},
+            'syscalls': self.snapshot_syscalls(),
+        }
+        if stats is not None:
+            data['files'] = {key: stats[key] for key in ('moved', 'skipped', 'errors', 'resumed', 'duplicates')}
+            data['bytes_copied'] = stats['bytes_copied']
+        return data
+    
+    def to_prometheus(self, stats: Dict = None) -> str:
+        """Metrics in the Prometheus text format, for the node exporter textfile collector"""
+        lines = [
+            '# HELP file_sorter_phase_seconds_total Time spent in each sorting phase.',
+            '# TYPE file_sorter_phase_seconds_total counter',
+        ]
+        lines.extend(f'file_sorter_phase_seconds_total{{phase="{phase}"}} {self.seconds[phase]:.6f}'
+                     for phase in self.PHASES)
+        lines.append('# HELP file_sorter_phase_calls_total Operations timed in each sorting phase.')
+        lines.append('# TYPE file_sorter_phase_calls_total counter')
+        lines.extend(f'file_sorter_phase_calls_total{{phase="{phase}"}} {self.calls[phase]}'
+                     for phase in self.PHASES)
+        lines.append('# HELP file_sorter_syscalls_total System calls made by the sorter.')
+        lines.append('# TYPE file_sorter_syscalls_total counter')
+        lines.extend(f'file_sorter_syscalls_total{{syscall="{name}"}} {count}'
+                     for name, count in sorted(self.snapshot_syscalls().items()))
+        if stats is not None:
+            lines.append('# HELP file_sorter_files_total Files handled, by outcome.')
+            lines.append('# TYPE file_sorter_files_total counter')
+            lines.extend(f'file_sorter_files_total{{result="{key}"}} {stats[key]}'
+                         for key in ('moved', 'skipped', 'errors', 'resumed', 'duplicates'))
+            lines.append('# HELP file_sorter_bytes_copied_total Bytes copied by cross-device moves.')
+            lines.append('# TYPE file_sorter_bytes_copied_total counter')
+            lines.append(f"file_sorter_bytes_copied_total {stats['bytes_copied']}")
+        lines.append('# HELP file_sorter_last_run_timestamp_seconds When these metrics were written.')
+        lines.append('# TYPE file_sorter_last_run_timestamp_seconds gauge')
+        lines.append(f'file_sorter_last_run_timestamp_seconds {time.time():.0f}')
+        return '\n'.join(lines) + '\n'
+
+
+def _open_plan(plan_path: str, mode: str):
+    """Open a plan file as UTF-8 text, gzip-compressed if it ends in .gz"""
+    if plan_path.endswith('.gz'):
+        return gzip.open(plan_path, mode + 't', encoding='utf-8')
+    return open(plan_path, mode, encoding='utf-8')
+
+
+def read_plan(plan_path: str) -> Tuple[Dict, Iterator[MoveOp]]:
+    """Read a plan written by FileSorter.write_plan
+    
+    Returns the header and a generator of MoveOps with absolute paths; the
+    moves are read lazily, so a plan of any size can be executed.
+    """
+    f = _open_plan(plan_path, 'r')
+    header = json.loads(f.readline())
+    if header.get('version') != PLAN_VERSION:
+        f.close()
+        raise ValueError(f"Unsupported plan version: {header.get('version')}")
+    
+    def ops():
+        with f:
+            for line in f:
+                source, destination, category, size = json.loads(line)
+                yield MoveOp(os.path.join(header['source'], source),
+                             os.path.join(header['target'], destination),
+                             category, size)
+    
+    return header, ops()
+
+
+class MoveJournal:
+    """Append-only write-ahead journal of moves
+    
+    An intent record ["i", source, destination] is written before each
+    move and a done record ["d", source] after it (["f", source] if it
+    failed). When a hardlink dedup places a duplicate as a link to its
+    original, the intent carries the original as a fourth element. Each
+    record is a single O_APPEND write, so it survives the process being
+    killed and several processes can share one journal. fsync runs every
+    sync_every records and on close, which bounds what an OS crash or
+    power loss can take with it.
+    """
+    
+    def __init__(self, path: str, sync_every: int = JOURNAL_SYNC_EVERY):
+        self.path = path
+        self.sync_every = max(1, sync_every)
+        self._unsynced = 0
+        self._lock = threading.Lock()
+        
+        # A line torn by a crash must be terminated so the next record starts clean
+        try:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b'\n'
+        except OSError:
+            torn = False
+        
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if torn:
+            os.write(self._fd, b'\n')
+    
+    def _write(self, record: List) -> None:
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8', 'surrogateescape')
+        with self._lock:
+            os.write(self._fd, line)
+            self._unsynced += 1
+            if self._unsynced >= self.sync_every:
+                os.fsync(self._fd)
+                self._unsynced = 0
+    
+    def intent(self, source: str, destination: str, link_to: str = None) -> None:
+        if link_to is None:
+            self._write(['i', source, destination])
+        else:
+            self._write(['i', source, destination, link_to])
+    
+    def done(self, source: str) -> None:
+        self._write(['d', source])
+    
+    def failed(self, source: str) -> None:
+        self._write(['f', source])
+    
+    def close(self) -> None:
+        with self._lock:
+            if self._fd is not None:
+                os.fsync(self._fd)
+                os.close(self._fd)
+                self._fd = None
+    
+    @staticmethod
+    def replay(path: str) -> Tuple[Dict[str, str], Dict[str, str], Dict[str, str]]:
+        """Read a journal back
+        
+        Returns source -> destination for the moves that finished and for
+        those that were started but never finished; the destination is the
+        one named by the source's last intent. The third dict maps the
+        unfinished moves that were hard-link placements to the original
+        linked to. A torn last line from a crash is ignored.
+        """
+        done = {}
+        pending = {}
+        links = {}
+        try:
+            with open(path, encoding='utf-8', errors='surrogateescape') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record[0] == 'i':
+                        pending[record[1]] = record[2]
+                        if len(record) > 3:
+                            links[record[1]] = record[3]
+                        else:
+                            links.pop(record[1], None)
+                    else:
+                        destination = pending.pop(record[1], None)
+                        links.pop(record[1], None)
+                        if record[0] == 'd':
+                            done[record[1]] = destination
+        except FileNotFoundError:
+            pass
+        return done, pending, links
+
+
+class UndoLog:
+    """Compact log of the moves made by a run, for --undo
+    
+    The first line is a JSON header with the source and target roots (the
+    same layout as a move plan); each following line is a
+    [source, destination] pair relative to them, with a third element
+    "link" when the destination was made a hard link to a duplicate's
+    original rather than moved there. Records are buffered and
+    appended in blocks with single O_APPEND writes, so shard workers can
+    share one log. A log created here that never gets a record is removed
+    again on close.
+    """
+    
+    def __init__(self, path: str, source_dir: str, target_dir: str):
+        self.path = path
+        self.source_dir = source_dir
+        self.target_dir = target_dir
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._header_size = None
+        
+        if os.fstat(self._fd).st_size == 0:
+            header = {'version': PLAN_VERSION, 'kind': 'undo',
+                      'source': source_dir, 'target': target_dir,
+                      'created': datetime.now().isoformat(timespec='seconds')}
+            self._header_size = os.write(self._fd, (json.dumps(header) + '\n').encode('utf-8'))
+    
+    def record(self, source: str, destination: str, linked: bool = False) -> None:
+        entry = [os.path.relpath(source, self.source_dir),
+                 os.path.relpath(destination, self.target_dir)]
+        if linked:
+            entry.append('link')
+        line = json.dumps(entry, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._buffer.append(line)
+            self._buffered += len(line)
+            if (self._buffered >= UNDO_BUFFER_SIZE
+                    or time.monotonic() - self._last_flush >= UNDO_FLUSH_INTERVAL):
+                self._flush()
+    
+    def flush(self) -> None:
+        """Append the buffered records now, e.g. at the end of a batch"""
+        with self._lock:
+            if self._fd is not None:
+                self._flush()
+    
+    def _flush(self) -> None:
+        if self._buffer:
+            os.write(self._fd, ''.join(self._buffer).encode('utf-8', 'surrogateescape'))
+            self._buffer = []
+            self._buffered = 0
+        self._last_flush = time.monotonic()
+    
+    def close(self) -> None:
+        with self._lock:
+            if self._fd is not None:
+                self._flush()
+                empty = (self._header_size is not None
+                         and os.fstat(self._fd).st_size == self._header_size)
+                os.close(self._fd)
+                self._fd = None
+                if empty:
+                    os.remove(self.path)
+    
+    @staticmethod
+    def read(path: str) -> Tuple[Dict, List[Tuple[str, str]], Set[str]]:
+        """Read a log back
+        
+        Returns the header, the (source, destination) pairs as absolute
+        paths, and the set of destinations that were hard-link placements.
+        """
+        with open(path, encoding='utf-8', errors='surrogateescape') as f:
+            header = json.loads(f.readline())
+            if header.get('kind') != 'undo':
+                raise ValueError(f"Not an undo log: {path}")
+            pairs = []
+            linked = set()
+            for line in f:
+                try:
+                    source, destination, *flags = json.loads(line)
+                except ValueError:
+                    continue
+                pair = (os.path.join(header['source'], source),
+                        os.path.join(header['target'], destination))
+                pairs.append(pair)
+                if 'link' in flags:
+                    linked.add(pair[1])
+        return header, pairs, linked
+
+
+def _load_renameat2():
+    """libc's renameat2 (Linux, glibc 2.28+) through ctypes, or None"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        function = libc.renameat2
+    except (OSError, AttributeError):
+        return None
+    function.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    function.restype = ctypes.c_int
+    return function
+
+
+_renameat2 = _load_renameat2()
+
+
+def rename_no_replace(source: str, destination: str) -> bool:
+    """Rename with RENAME_NOREPLACE, in one syscall
+    
+    Returns False if renameat2 or the flag is not supported here, so the
+    caller can fall back. Raises FileExistsError if destination is taken,
+    and the usual OSError subclasses for other failures (EXDEV included).
+    """
+    if _renameat2 is None:
+        return False
+    if _renameat2(AT_FDCWD, os.fsencode(source), AT_FDCWD, os.fsencode(destination),
+                  RENAME_NOREPLACE) == 0:
+        return True
+    error = ctypes.get_errno()
+    if error in NO_RENAMEAT2_ERRNOS:
+        return False
+    raise OSError(error, os.strerror(error), source, None, destination)
+
+
+class InotifyWatcher:
+    """Reports files closed after writing, or moved in, via Linux inotify
+    
+    Bound through ctypes so no extra package is needed. wait() returns the
+    names of files that had IN_CLOSE_WRITE or IN_MOVED_TO events, or None
+    if the kernel event queue overflowed and the directory must be rescanned.
+    """
+    
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    IN_CLOEXEC = 0o2000000
+    _EVENT = struct.Struct('iIII')
+    
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = libc.inotify_init1(self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(error, f'inotify_add_watch failed for {directory}')
+    
+    @staticmethod
+    def available() -> bool:
+        return sys.platform.startswith('linux')
+    
+    def wait(self, timeout: float):
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        
+        data = os.read(self._fd, 64 * 1024)
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & self.IN_Q_OVERFLOW:
+                return None
+            if name and not mask & self.IN_ISDIR:
+                names.append(os.fsdecode(name))
+        return names
+    
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Portable stand-in for InotifyWatcher
+    
+    Rescans the directory every interval and reports files whose size or
+    mtime changed since the previous scan. Its cost grows with the
+    directory size, so it is only used where inotify is not available.
+    """
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._seen = self._snapshot()
+    
+    def _snapshot(self) -> Dict[str, Tuple[int, int]]:
+        seen = {}
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_file():
+                        info = entry.stat()
+                        seen[entry.name] = (info.st_size, info.st_mtime_ns)
+                except OSError:
+                    continue
+        return seen
+    
+    def wait(self, timeout: float):
+        time.sleep(timeout)
+        current = self._snapshot()
+        changed = [name for name, state in current.items() if self._seen.get(name) != state]
+        self._seen = current
+        return changed
+    
+    def close(self) -> None:
+        pass
+
+
+class ScanIndex:
+    """On-disk record of what earlier runs saw, for fast re-runs
+    
+    Stored in SQLite. The dirs table keeps each listed directory's
+    (st_dev, st_ino, st_mtime_ns) and its subdirectories. A directory whose
+    stat still matches has had no entries added, removed or renamed, so
+    its listing is skipped and only its recorded subdirectories are
+    visited.
+    
+    That only holds while the files left behind are left for the same
+    reasons, so the meta table keeps a digest of the sorter configuration
+    (see FileSorter.index_config). When it differs, every directory
+    record is dropped and the tree is listed again.
+    
+    Only use it for runs that actually move files: a dry run or a plan
+    would mark directories as done without moving anything.
+    """
+    
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, dev INTEGER, ino INTEGER, '
+        'mtime_ns INTEGER, subdirs TEXT)',
+        'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+    )
+    
+    def __init__(self, path: str, config: str = ''):
+        self.path = path
+        self.config = config
+        self._db = sqlite3.connect(path)
+        for statement in self.SCHEMA:
+            self._db.execute(statement)
+        row = self._db.execute("SELECT value FROM meta WHERE key='config'").fetchone()
+        self._config_changed = row is None or row[0] != config
+        self._dirs = {}
+        if not self._config_changed:
+            self._dirs = {row[0]: row[1:] for row in self._db.execute('SELECT * FROM dirs')}
+        self._dir_updates = {}
+        self._stale = set()
+        self._lock = threading.Lock()
+    
+    def unchanged_subdirs(self, path: str, info: os.stat_result):
+        """Recorded subdirectories if path is unchanged since it was listed, else None"""
+        record = self._dirs.get(path)
+        if record is None or record[:3] != (info.st_dev, info.st_ino, info.st_mtime_ns):
+            return None
+        return json.loads(record[3])
+    
+    def record_directory(self, path: str, info: os.stat_result, subdirs: List[str]) -> None:
+        """Remember a directory as listed (stat taken before the listing)"""
+        record = (info.st_dev, info.st_ino, info.st_mtime_ns, json.dumps(subdirs))
+        self._dirs[path] = record
+        self._dir_updates[path] = record
+    
+    def forget_directory(self, path: str) -> None:
+        """Make the next run list path again, e.g. after a failed move out of it"""
+        with self._lock:
+            self._stale.add(path)
+    
+    def close(self, complete: bool = True) -> None:
+        """Write out everything recorded during the run
+        
+        Directories are listed before their files are moved, so after an
+        interrupted or failed run (complete=False) their records are
+        dropped: the next run must list them again to find the files that
+        were never reached. Records made under a different configuration
+        are dropped either way.
+        """
+        if not complete:
+            self._dir_updates.clear()
+        for path in self._stale:
+            self._dir_updates.pop(path, None)
+        with self._db:
+            if self._config_changed:
+                self._db.execute('DELETE FROM dirs')
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('config', ?)", (self.config,))
+            self._db.executemany('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?)',
+                                 [(path,) + record for path, record in self._dir_updates.items()])
+            self._db.executemany('DELETE FROM dirs WHERE path=?', [(path,) for path in self._stale])
+        self._db.close()
+
+
+class MagicSniffer:
+    """Classify files by their leading bytes
+    
+    The signature table is compiled into one anchored bytes regex, so each
+    file costs a single read of SNIFF_BYTES and a single match. Results are
+    cached by (device, inode, mtime, size), so a file is read at most once
+    per process however often it is classified.
+    """
+    
+    def __init__(self, signatures: Iterable[Tuple[int, bytes, str]] = MAGIC_SIGNATURES):
+        self.categories = {}
+        patterns = []
+        for number, (offset, magic, category) in enumerate(signatures):
+            group = f's{number}'
+            self.categories[group] = category
+            patterns.append(b'(?P<%s>.{%d}%s)' % (group.encode(), offset, re.escape(magic)))
+        self._pattern = re.compile(b'|'.join(patterns), re.DOTALL)
+        self._cache = {}
+    
+    def sniff(self, entry: ScanEntry):
+        """Return the category for an entry's content, or None if unrecognized"""
+        try:
+            info = entry.stat()
+        except OSError:
+            return None
+        key = (info.st_dev, info.st_ino, info.st_mtime_ns, info.st_size)
+        if key in self._cache:
+            return self._cache[key]
+        
+        try:
+            with open(entry.path, 'rb') as f:
+                head = f.read(SNIFF_BYTES)
+        except OSError:
+            return None
+        match = self._pattern.match(head)
+        category = self.categories[match.lastgroup] if match else None
+        self._cache[key] = category
+        return category
+
+
+def _sample_digest(path: str, size: int) -> bytes:
+    """Hash the first and last DEDUP_SAMPLE_SIZE bytes of a file
+    
+    For a file no larger than two samples this covers every byte, so the
+    digest is as good as a full hash.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(DEDUP_SAMPLE_SIZE))
+        if size > DEDUP_SAMPLE_SIZE:
+            f.seek(max(DEDUP_SAMPLE_SIZE, size - DEDUP_SAMPLE_SIZE))
+            digest.update(f.read(DEDUP_SAMPLE_SIZE))
+    return digest.digest()
+
+
+def _full_digest(path: str) -> bytes:
+    """Hash a whole file through mmap, or COPY_CHUNK_SIZE reads if that fails"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                digest.update(view)
+        except (ValueError, OSError):
+            for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.digest()
+
+
+def find_duplicates(candidates: Iterable[ScanEntry],
+                    existing: Iterable[ScanEntry] = ()) -> Dict[str, str]:
+    """Find candidates whose content matches an earlier file
+    
+    Returns {duplicate path: original path}. Files are grouped by size,
+    then by _sample_digest, and only files still matching after both are
+    fully hashed, so most files are never read at all. An existing file
+    is preferred as the original; otherwise the first candidate in path
+    order is kept. Empty files are never treated as duplicates.
+    """
+    by_size = {}
+    for is_new, entries in ((False, existing), (True, candidates)):
+        for entry in entries:
+            try:
+                size = entry.size
+            except OSError:
+                continue
+            if size:
+                by_size.setdefault(size, []).append((is_new, entry.path))
+    
+    duplicates = {}
+    for size, group in by_size.items():
+        if len(group) < 2 or not any(is_new for is_new, _ in group):
+            continue
+        group.sort()
+        
+        by_sample = {}
+        for is_new, path in group:
+            try:
+                by_sample.setdefault(_sample_digest(path, size), []).append((is_new, path))
+            except OSError:
+                pass
+        
+        for same_sample in by_sample.values():
+            if len(same_sample) < 2:
+                continue
+            if size <= 2 * DEDUP_SAMPLE_SIZE:
+                same_content = [same_sample]
+            else:
+                by_digest = {}
+                for is_new, path in same_sample:
+                    try:
+                        by_digest.setdefault(_full_digest(path), []).append((is_new, path))
+                    except OSError:
+                        pass
+                same_content = by_digest.values()
+            
+            for files in same_content:
+                original = files[0][1]
+                for is_new, path in files[1:]:
+                    if is_new:
+                        duplicates[path] = original
+    
+    return duplicates
+
+
+# A routing rule: files matching every condition that is set go to category.
+# Sizes are in bytes, ages in seconds, after/before are mtime timestamps.
+Rule = namedtuple('Rule', ['category', 'extensions', 'min_size', 'max_size',
+                           'min_age', 'max_age', 'after', 'before'])
+Rule.__new__.__defaults__ = (None,) * 7
+
+_RULE_CONDITION_RE = re.compile(r'^\s*(ext|size|age|mtime)\s*([=<>])\s*(\S+)\s*$')
+_SIZE_UNITS = {'': 1, 'B': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+_AGE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400, 'y': 365 * 86400}
+_DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S')
+
+
+def parse_rule(text: str) -> Rule:
+    """Parse a rule written as CATEGORY:COND[,COND...]
+    
+    Conditions are ext=.iso|.img, size>N or size<N (with an optional K, M,
+    G or T suffix), age>N or age<N (N with s, m, h, d, w or y; days if
+    bare) and mtime>DATE or mtime<DATE (YYYY-MM-DD, optionally with a
+    THH:MM[:SS] time). For example
+    'Cold:size>1G' or 'Old/Documents:ext=.pdf|.doc,age>1y'.
+    """
+    category, sep, conditions = text.partition(':')
+    category = category.strip().strip('/')
+    if not sep or not category:
+        raise ValueError(f"Rule needs the form CATEGORY:CONDITION[,...]: {text!r}")
+    
+    fields = {}
+    for condition in conditions.split(','):
+        match = _RULE_CONDITION_RE.match(condition)
+        if not match:
+            raise ValueError(f"Bad rule condition: {condition!r}")
+        name, op, value = match.groups()
+        
+        if name == 'ext':
+            if op != '=':
+                raise ValueError(f"ext only supports '=': {condition!r}")
+            fields['extensions'] = frozenset(
+                ext.lower() if ext.startswith('.') else '.' + ext.lower()
+                for ext in value.split('|') if ext)
+            continue
+        if op == '=':
+            raise ValueError(f"{name} needs '<' or '>': {condition!r}")
+        
+        if name == 'size':
+            number = re.match(r'^(\d+(?:\.\d+)?)([BKMGT]?)$', value.upper())
+            if not number:
+                raise ValueError(f"Bad size: {value!r}")
+            amount = int(float(number.group(1)) * _SIZE_UNITS[number.group(2)])
+            fields['min_size' if op == '>' else 'max_size'] = amount
+        elif name == 'age':
+            number = re.match(r'^(\d+(?:\.\d+)?)([smhdwy]?)$', value)
+            if not number:
+                raise ValueError(f"Bad age: {value!r}")
+            amount = float(number.group(1)) * _AGE_UNITS[number.group(2) or 'd']
+            fields['min_age' if op == '>' else 'max_age'] = amount
+        else:
+            timestamp = _parse_date(value)
+            fields['after' if op == '>' else 'before'] = timestamp
+    
+    return Rule(category, **fields)
+
+
+def _parse_date(value: str) -> float:
+    """Timestamp of an ISO date, with an optional THH:MM[:SS] time, in local time"""
+    for date_format in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).timestamp()
+        except ValueError:
+            pass
+    raise ValueError(f"Bad date: {value!r}")
+
+
+class RuleSet:
+    """Rules compiled for first-match evaluation
+    
+    Extension conditions need only the name, so rules are pre-sorted into
+    one ordered candidate list per extension named by any rule, plus a list
+    for every other extension. Each rule's remaining conditions become
+    (field, op, value) checks on the stat result. The stat is only fetched
+    if a candidate rule has such checks, and the ScanEntry caches it, so a
+    file is stat'ed at most once however many rules look at it.
+    """
+    
+    def __init__(self, rules: Iterable[Rule]):
+        self.rules = list(rules)
+        compiled = [(rule.category, rule.extensions, self._checks(rule)) for rule in self.rules]
+        
+        extensions = set()
+        for _, rule_extensions, _ in compiled:
+            extensions.update(rule_extensions or ())
+        
+        def candidates(extension):
+            return [(category, checks) for category, rule_extensions, checks in compiled
+                    if rule_extensions is None or extension in rule_extensions]
+        
+        self._by_extension = {extension: candidates(extension) for extension in extensions}
+        self._default = candidates(None)
+        self.categories = {rule.category for rule in self.rules}
+    
+    @staticmethod
+    def _checks(rule: Rule) -> List[Tuple[str, bool, float]]:
+        """(stat field, must be greater, value) checks for a rule; age is
+        turned into an mtime bound when the rule is evaluated"""
+        checks = []
+        if rule.min_size is not None:
+            checks.append(('size', True, rule.min_size))
+        if rule.max_size is not None:
+            checks.append(('size', False, rule.max_size))
+        if rule.after is not None:
+            checks.append(('mtime', True, rule.after))
+        if rule.before is not None:
+            checks.append(('mtime', False, rule.before))
+        if rule.min_age is not None:
+            checks.append(('age', True, rule.min_age))
+        if rule.max_age is not None:
+            checks.append(('age', False, rule.max_age))
+        return checks
+    
+    def match(self, entry: ScanEntry):
+        """Return the category of the first rule the entry matches, or None"""
+        candidates = self._by_extension.get(entry.suffix.lower(), self._default)
+        info = now = None
+        
+        for category, checks in candidates:
+            for field, greater, value in checks:
+                if info is None:
+                    try:
+                        info = entry.stat()
+                    except OSError:
+                        return None
+                if field == 'size':
+                    actual = info.st_size
+                elif field == 'mtime':
+                    actual = info.st_mtime
+                else:
+                    if now is None:
+                        now = time.time()
+                    actual = now - info.st_mtime
+                if (actual <= value) if greater else (actual >= value):
+                    break
+            else:
+                return category
+        return None
+
+
+# A file name pattern: action is 'skip', 'include' (sort even if a later
+# pattern or a built-in rule would skip it) or 'route' (sort into category).
+# pattern is a glob, or a regular expression when prefixed with 're:'.
+NamePattern = namedtuple('NamePattern', ['action', 'pattern', 'category'])
+NamePattern.__new__.__defaults__ = (None,)
+
+NAME_PATTERN_ACTIONS = ('skip', 'include', 'route')
+
+
+def parse_route(text: str) -> NamePattern:
+    """Parse a routing pattern written as CATEGORY:PATTERN"""
+    category, sep, pattern = text.partition(':')
+    category = category.strip().strip('/')
+    if not sep or not category or not pattern:
+        raise ValueError(f"Route needs the form CATEGORY:PATTERN: {text!r}")
+    return NamePattern('route', pattern, category)
+
+
+def read_name_patterns(path: str) -> List[NamePattern]:
+    """Read name patterns from a file, one per line, in order
+    
+    Lines are 'skip PATTERN', 'include PATTERN' or 'route CATEGORY PATTERN';
+    blank lines and lines starting with '#' are ignored.
+    """
+    patterns = []
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            action, _, rest = line.partition(' ')
+            rest = rest.strip()
+            if action == 'route':
+                category, _, pattern = rest.partition(' ')
+                pattern = pattern.strip()
+            else:
+                category, pattern = None, rest
+            if action not in NAME_PATTERN_ACTIONS or not pattern:
+                raise ValueError(f"{path}:{number}: expected 'skip PATTERN', "
+                                 f"'include PATTERN' or 'route CATEGORY PATTERN'")
+            patterns.append(NamePattern(action, pattern, category))
+    return patterns
+
+
+class NameMatcher:
+    """Ordered name patterns compiled into one regular expression
+    
+    Every pattern becomes a named alternative of a single anchored regex,
+    so a file name is tested against all of them with one match call and
+    the first pattern in order that matches wins. Each pattern is compiled
+    on its own first, so a bad one raises ValueError naming it. Leading
+    (?i), (?m) or (?s) flags are turned into a scoped group; a pattern that
+    cannot be combined without changing its meaning (capturing groups,
+    whose numbers and names would clash, or other global flags) is
+    matched with its own regex, in its place in the order.
+    """
+    
+    _LEADING_FLAGS = re.compile(r'\(\?([aiLmsux]+)\)')
+    
+    def __init__(self, patterns: Iterable[NamePattern]):
+        self.patterns = list(patterns)
+        self._segments = []
+        alternatives = []
+        for number, pattern in enumerate(self.patterns):
+            source = self._combinable(pattern.pattern)
+            if source is not None:
+                alternatives.append(f'(?P<p{number}>(?:{source})\\Z)')
+                continue
+            if alternatives:
+                self._segments.append((re.compile('|'.join(alternatives)), None))
+                alternatives = []
+            self._segments.append((self._compile(pattern.pattern), number))
+        if alternatives:
+            self._segments.append((re.compile('|'.join(alternatives)), None))
+        self.routes = any(pattern.action == 'route' for pattern in self.patterns)
+    
+    @staticmethod
+    def _compile(pattern: str):
+        """Compile a glob or 're:' pattern on its own"""
+        if not pattern.startswith('re:'):
+            return re.compile(fnmatch.translate(pattern))
+        try:
+            return re.compile(pattern[3:])
+        except re.error as e:
+            raise ValueError(f"Bad regular expression {pattern!r}: {e}")
+    
+    def _combinable(self, pattern: str):
+        """Regex source that can join the combined regex, or None"""
+        compiled = self._compile(pattern)
+        source = compiled.pattern
+        flags = ''
+        match = self._LEADING_FLAGS.match(source)
+        while match is not None:
+            flags += match.group(1)
+            source = source[match.end():]
+            match = self._LEADING_FLAGS.match(source)
+        if flags:
+            if set(flags) - set('ims'):
+                return None
+            source = f'(?{flags}:{source})'
+            compiled = re.compile(source)
+        if compiled.groups or compiled.flags & ~re.UNICODE:
+            return None
+        return source
+    
+    def match(self, name: str):
+        """Return the first NamePattern matching name, or None"""
+        for regex, number in self._segments:
+            if number is not None:
+                if regex.fullmatch(name):
+                    return self.patterns[number]
+                continue
+            match = regex.match(name)
+            if match is not None:
+                return self.patterns[int(match.lastgroup[1:])]
+        return None
+
+
+def split_name(file_name: str) -> Tuple[str, str]:
+    """Split a file name into (stem, suffix) with the same rules as pathlib"""
+    i = file_name.rfind('.')
+    if 0 < i < len(file_name) - 1:
+        return file_name[:i], file_name[i:]
+    return file_name, ''
+
+
+class NameRegistry:
+    """In-memory record of the names used in one destination folder
+    
+    Seeded with a single scandir of the folder, then updated as names are
+    handed out. For every stem/suffix pair it tracks the highest N used in
+    a 'stem_N.suffix' name, so picking a free collision name takes no
+    stat calls no matter how many duplicates the folder already holds.
+    """
+    
+    _COUNTER_RE = re.compile(r'^(.*)_(\d+)$')
+    
+    def __init__(self, folder: str):
+        self.names = set()
+        self.highest = {}
+        try:
+            with os.scandir(folder) as it:
+                for entry in it:
+                    self.add(entry.name)
+        except FileNotFoundError:
+            pass
+    
+    def add(self, name: str) -> None:
+        """Record a name as used"""
+        self.names.add(name)
+        stem, suffix = split_name(name)
+        match = self._COUNTER_RE.match(stem)
+        if match:
+            key = (match.group(1), suffix)
+            counter = int(match.group(2))
+            if counter > self.highest.get(key, 0):
+                self.highest[key] = counter
+    
+    def discard(self, name: str) -> None:
+        """Forget a name whose move did not happen (counters are kept)"""
+        self.names.discard(name)
+    
+    def allocate(self, name: str) -> str:
+        """Return name if it is free, else the next stem_N variant, and record it"""
+        if name not in self.names:
+            self.add(name)
+            return name
+        
+        stem, suffix = split_name(name)
+        counter = self.highest.get((stem, suffix), 0) + 1
+        candidate = f"{stem}_{counter}{suffix}"
+        while candidate in self.names:
+            counter += 1
+            candidate = f"{stem}_{counter}{suffix}"
+        
+        self.add(candidate)
+        return candidate
+
+
+def copy_file_fast(source: str, destination: str, metrics: PhaseMetrics = None) -> int:
+    """Copy a file's contents using kernel-side copy primitives
+    
+    Tries os.copy_file_range first, which also lets filesystems that
+    support it clone extents or copy server-side. Otherwise falls back to
+    shutil.copyfile, which uses sendfile/fcopyfile on Linux and macOS. Some
+    FUSE, NFS and procfs-like filesystems make copy_file_range report end
+    of file early, so a copy that does not match the source size falls
+    back too. Returns the number of bytes copied; raises OSError if even
+    the fallback does not copy the whole file. The calls made are counted
+    in metrics, if given, under the primitive that made them.
+    """
+    with open(source, 'rb') as src:
+        size = os.fstat(src.fileno()).st_size
+        if hasattr(os, 'copy_file_range'):
+            calls = 0
+            try:
+                with open(destination, 'wb') as dst:
+                    offset = 0
+                    while True:
+                        calls += 1
+                        copied = os.copy_file_range(src.fileno(), dst.fileno(),
+                                                    COPY_CHUNK_SIZE, offset, offset)
+                        if not copied:
+                            break
+                        offset += copied
+                if offset == size:
+                    return offset
+            except OSError:
+                # Not supported between these filesystems; copyfile overwrites
+                pass
+            finally:
+                if metrics is not None:
+                    metrics.syscall('copy_file_range', calls)
+    
+    if metrics is not None:
+        metrics.syscall('copyfile')
+    shutil.copyfile(source, destination)
+    copied = os.stat(destination).st_size
+    if copied != size:
+        raise OSError(errno.EIO, f"Copied {copied} of {size} bytes", source)
+    return copied
+
+
+def _copy_temp_path(destination: str) -> str:
+    """Hidden name a cross-device copy to destination is written under"""
+    folder, name = os.path.split(destination)
+    return os.path.join(folder, f'.{name}{COPY_TEMP_SUFFIX}')
+
+
+def scan_files(directory, recursive: bool = False, prune: Callable[[str, str], bool] = None,
+               metrics: PhaseMetrics = None) -> Iterator[ScanEntry]:
+    """Yield the regular files in a directory using os.scandir
+    
+    File type checks use the d_type information returned by the directory
+    listing, so no per-file stat is needed. Symlinked directories are not
+    followed when scanning recursively, and subdirectories for which
+    prune(path, name) is true are not entered at all. Errors on the
+    top-level directory are raised; unreadable subdirectories are skipped.
+    Directory listings, and the stats the entries make, are counted in
+    metrics, if given.
+    """
+    root = str(directory)
+    pending = [root]
+    
+    while pending:
+        current = pending.pop()
+        if metrics is not None:
+            metrics.syscall('scandir')
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    try:
+                        if entry.is_file():
+                            yield ScanEntry(entry, metrics)
+                        elif recursive and entry.is_dir(follow_symlinks=False):
+                            if prune is None or not prune(entry.path, entry.name):
+                                pending.append(entry.path)
+                    except OSError:
+                        continue
+        except OSError:
+            if current == root:
+                raise
+
 class FileSorter:
     """Main file sorting class with customizable rules and safety features"""
     
-    def __init__(self, source_dir: str = ".", target_dir: str = None):
-        self.source_dir = Path(source_dir).resolve()
-        self.target_dir = Path(target_dir).resolve() if target_dir else self.source_dir
+    def __init__(self, source_dir: str = ".", target_dir: str = None,
+                 workers: int = 1, device_limit: int = DEFAULT_DEVICE_LIMIT,
+                 exclude: Iterable[str] = (), sniff: bool = False, dedup: str = None,
+                 layout: str = None, max_entries: int = SHARD_MAX_ENTRIES,
+                 rules: Iterable[Rule] = (), name_patterns: Iterable[NamePattern] = (),
+                 quiet: bool = False, metrics: bool = False):
+        self.source_dir = Path(source_dir).expanduser().resolve()
+        self.target_dir = Path(target_dir).expanduser().resolve() if target_dir else self.source_dir
+        
+        # Where progress and per-file results go; quiet runs use the no-op
+        # base Reporter. Replace with set_reporter().
+        self.reporter = None
+        self.set_reporter(Reporter() if quiet else ConsoleReporter())
+        
+        # Per-phase timers and syscall counters, or None when not measuring
+        self.metrics = PhaseMetrics() if metrics else None
+        
+        # Directory globs never descended into by recursive scans, matched
+        # against the directory name and its path relative to the source
+        self.exclude = []
+        self._exclude_re = None
+        self.set_exclude(exclude)
+        
+        # Parallel move settings: number of move threads, and how many of
+        # them may work on the same source/destination device at once
+        self.workers = max(1, workers)
+        self.device_limit = max(1, device_limit)
         
         # Predefined file type categories
         self.file_categories = {
@@ -26,162 +1563,1610 @@ class FileSorter:
             'Presentations': {'.ppt', '.pptx', '.odp', '.key'},
             'Videos': {'.mp4', '.avi', '.mkv', '.mov', '.wmv', '.flv', '.webm', '.m4v'},
             'Audio': {'.mp3', '.wav', '.flac', '.aac', '.ogg', '.wma', '.m4a'},
-            'Archives': {'.zip', '.rar', '.7z', '.tar', '.gz', '.bz2', '.xz'},
+            'Archives': {'.zip', '.rar', '.7z', '.tar', '.gz', '.bz2', '.xz',
+                         '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz'},
             'Code': {'.py', '.js', '.html', '.css', '.java', '.cpp', '.c', '.php', '.rb', '.go'},
             'Executables': {'.exe', '.msi', '.deb', '.rpm', '.dmg', '.pkg', '.app'},
             'Fonts': {'.ttf', '.otf', '.woff', '.woff2', '.eot'}
         }
         
+        # Flattened, lower-cased extension -> category lookup built from
+        # file_categories. Change categories through set_category(),
+        # add_extensions() or remove_category() so it stays in sync.
+        self._extension_index = {}
+        self._max_extension_parts = 1
+        self._rebuild_extension_index()
+        
         # Files to skip (system files, hidden files, etc.)
         self.skip_files = {'.DS_Store', 'Thumbs.db', 'desktop.ini', '.gitignore', '.gitkeep'}
         self.skip_extensions = {'.tmp', '.temp', '.log'}
         
+        # User name patterns, checked in order before the built-in skips.
+        # Everything is compiled into one NameMatcher; change patterns with
+        # set_name_patterns() and call it after editing skip_files or
+        # skip_extensions so the matcher stays in sync.
+        self.name_patterns = []
+        self._name_matcher = None
+        self.set_name_patterns(name_patterns)
+        
+        # Content sniffer for files whose extension is missing or in
+        # AMBIGUOUS_EXTENSIONS; None keeps classification name-only
+        self.sniffer = MagicSniffer() if sniff else None
+        
+        # Routing rules on extension, size and age, checked before any of
+        # the above; see set_rules()
+        self.rules = None
+        self.set_rules(rules)
+        
+        # What to do with files whose content is already in the run or the
+        # target: one of DEDUP_MODES, or None to move them like any other
+        if dedup is not None and dedup not in DEDUP_MODES:
+            raise ValueError(f"Unknown dedup mode: {dedup}")
+        self.dedup = dedup
+        
+        # Layout inside each category folder: one of SHARD_LAYOUTS, or None
+        # for a flat folder. A shard folder holding max_entries names spills
+        # into 'name.1', 'name.2', ...; the spill index reached per shard is
+        # kept in _shard_spill.
+        if layout is not None and layout not in SHARD_LAYOUTS:
+            raise ValueError(f"Unknown layout: {layout}")
+        self.layout = layout
+        self.max_entries = max(1, max_entries)
+        self._shard_spill = {}
+        
+        # Hardlink dedup: duplicates waiting for their original to be moved,
+        # and where each moved source ended up
+        self._pending_links = []
+        self._moved_to = None
+        
         # Statistics
         self.stats = {
             'moved': 0,
             'skipped': 0,
             'errors': 0,
-            'categories_created': set()
+            'categories_created': set(),
+            'strategies': {},
+            'bytes_copied': 0,
+            'resumed': 0,
+            'dirs_unchanged': 0,
+            'dirs_pruned': 0,
+            'sniffed': 0,
+            'rule_matches': 0,
+            'duplicates': 0
         }
+        self._stats_lock = threading.Lock()
+        
+        # Category folders known to exist, so mkdir runs once per folder,
+        # and categories whose folder has been marked (see _use_category)
+        self._known_folders = set()
+        self._marked_categories = set()
+        
+        # NameRegistry per destination folder, used for collision naming
+        self._name_registries = {}
+        self._names_lock = threading.Lock()
+        
+        # Write-ahead journal, plus what a resumed run learned from it:
+        # sources already moved and destinations kept for unfinished moves
+        self.journal = None
+        self.undo_log = None
+        self.index = None
+        self._resume_done = {}
+        self._resume_pending = {}
+        self._reserved = set()
+        
+        # Move strategy chosen per (source dir, destination dir) pair
+        self._strategies = {}
+        
+        # Parallel move state: st_dev per directory and a semaphore per device
+        self._dir_devices = {}
+        self._device_slots = {}
+    
+    def set_reporter(self, reporter: Reporter) -> None:
+        """Send progress and results to reporter (see Reporter)"""
+        if getattr(reporter, 'root', False) is None:
+            reporter.root = str(self.source_dir)
+        self.reporter = reporter
+    
+    def open_journal(self, journal_path: str, resume: bool = False) -> None:
+        """Journal every move to journal_path, optionally resuming from it
+        
+        With resume, the existing journal is replayed first (see
+        replay_journal and resume_from).
+        """
+        if resume:
+            self.resume_from(*self.replay_journal(journal_path))
+        self.journal = MoveJournal(journal_path)
+    
+    @staticmethod
+    def replay_journal(journal_path: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """Replay a journal and check its unfinished moves on disk
+        
+        Returns the finished moves and the unfinished ones still to redo,
+        as source -> destination. An unfinished move whose source is gone
+        but whose destination exists counts as finished. Otherwise the
+        hidden partial copy it may have left is removed, as is a second
+        link to the source left by a crash between link and unlink (or,
+        for a hardlink dedup placement, the link to its original). Any
+        other file at the destination belongs to someone else (e.g. a
+        competing shard worker) and is left alone; that move then gets a
+        fresh name. Nothing a finished move placed is ever removed.
+        """
+        done, pending, links = MoveJournal.replay(journal_path)
+        finished = set(done.values())
+        redo = {}
+        for source, destination in pending.items():
+            if not os.path.lexists(source):
+                if os.path.lexists(destination):
+                    done[source] = destination
+                continue
+            
+            partial = _copy_temp_path(destination)
+            if os.path.lexists(partial):
+                os.unlink(partial)
+            if not os.path.lexists(destination):
+                redo[source] = destination
+            elif destination not in finished:
+                placed = links.get(source, source)
+                if os.path.lexists(placed) and os.path.samefile(placed, destination):
+                    os.unlink(destination)
+                    redo[source] = destination
+        return done, redo
+    
+    def resume_from(self, done: Dict[str, str], pending: Dict[str, str]) -> None:
+        """Skip the finished moves, and redo the unfinished ones to the same names"""
+        self._resume_done = done
+        self._resume_pending = dict(pending)
+        self._reserved.update(pending.values())
+    
+    def close_journal(self) -> None:
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+    
+    def open_index(self, index_path: str = None) -> None:
+        """Use a ScanIndex (default: INDEX_FILE_NAME in the target) to skip unchanged work"""
+        if index_path is None:
+            self.target_dir.mkdir(parents=True, exist_ok=True)
+            index_path = str(self.target_dir / INDEX_FILE_NAME)
+        self.index = ScanIndex(index_path, self.index_config())
+    
+    def index_config(self) -> str:
+        """Digest of the settings that decide which files a run leaves in place
+        
+        Covers the name patterns (skip, include, route), the built-in skips,
+        the routing rules, the categories and whether content sniffing is on.
+        """
+        settings = [self.name_patterns, self.skip_files, self.skip_extensions,
+                    self.rules.rules if self.rules is not None else [],
+                    self.file_categories, self.sniffer is not None]
+        encoded = json.dumps(settings, sort_keys=True, default=sorted)
+        return hashlib.blake2b(encoded.encode('utf-8'), digest_size=16).hexdigest()
+    
+    def close_index(self, complete: bool = True) -> None:
+        if self.index is not None:
+            self.index.close(complete)
+            self.index = None
+    
+    def open_undo_log(self, undo_path: str) -> None:
+        """Record every successful move in an UndoLog at undo_path"""
+        self.undo_log = UndoLog(undo_path, str(self.source_dir), str(self.target_dir))
+    
+    def close_undo_log(self) -> None:
+        if self.undo_log is not None:
+            self.undo_log.close()
+            self.undo_log = None
+    
+    def default_undo_log_path(self) -> str:
+        """Timestamped hidden file in the target directory (skipped by sorting)"""
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        return str(self.target_dir / f'.file_sorter_undo_{stamp}.log')
+    
+    def undo(self, undo_path: str, dry_run: bool = False) -> None:
+        """Move the files recorded in an undo log back where they came from
+        
+        The log is replayed newest first, grouped by (current folder,
+        original folder) pair so each pair gets one move strategy decision
+        and one scandir of each side instead of a stat per file.
+        Same-device pairs are undone with a no-clobber rename. Hard links
+        made by hardlink dedup are restored as independent copies (see
+        _restore_copy). Files that are gone, or whose original name is
+        taken again, are left alone and reported. Category folders left
+        empty are then removed, deepest first.
+        """
+        header, pairs, linked = UndoLog.read(undo_path)
+        print(f"{'DRY RUN: ' if dry_run else ''}Undoing sort recorded in: {undo_path}")
+        print(f"Restoring into: {header['source']}")
+        print("-" * 50)
+        
+        groups = {}
+        for source, destination in reversed(pairs):
+            key = (os.path.dirname(destination), os.path.dirname(source))
+            groups.setdefault(key, []).append((source, destination))
+        
+        restored = missing = conflicts = 0
+        emptied = set()
+        current_names = {}
+        original_names = {}
+        
+        for (current_dir, original_dir), moves in groups.items():
+            if current_dir not in current_names:
+                current_names[current_dir] = NameRegistry(current_dir)
+            if original_dir not in original_names:
+                original_names[original_dir] = NameRegistry(original_dir)
+            current = current_names[current_dir]
+            original = original_names[original_dir]
+            
+            for source, destination in moves:
+                name = os.path.basename(destination)
+                original_name = os.path.basename(source)
+                if name not in current.names:
+                    missing += 1
+                    continue
+                if original_name in original.names:
+                    print(f"Conflict: {source} exists, leaving {destination}")
+                    conflicts += 1
+                    continue
+                
+                if dry_run:
+                    print(f"Would restore: {destination} → {source}")
+                    original.add(original_name)
+                    continue
+                
+                self._ensure_folder(Path(original_dir))
+                if destination in linked:
+                    placed = self._restore_copy(Path(destination), Path(source))
+                else:
+                    placed = self._transfer(Path(destination), Path(source), next_name=False)
+                if placed is not None:
+                    original.add(original_name)
+                    current.discard(name)
+                    restored += 1
+                    emptied.add(current_dir)
+        
+        removed = 0
+        if not dry_run:
+            # Remove folders (and their parents inside the target) left empty
+            target = header['target']
+            folders = set()
+            for folder in emptied:
+                while folder.startswith(target + os.sep):
+                    folders.add(folder)
+                    folder = os.path.dirname(folder)
+            for folder in sorted(folders, key=len, reverse=True):
+                try:
+                    if os.listdir(folder) == [CATEGORY_MARKER]:
+                        os.unlink(os.path.join(folder, CATEGORY_MARKER))
+                    os.rmdir(folder)
+                    removed += 1
+                except OSError:
+                    pass
+        
+        print("\n" + "=" * 50)
+        print(f"{'DRY RUN ' if dry_run else ''}UNDO COMPLETE!")
+        print("=" * 50)
+        print(f"Files restored: {restored}")
+        print(f"Missing (moved or deleted since): {missing}")
+        print(f"Conflicts (original name taken): {conflicts}")
+        print(f"Errors: {self.stats['errors']}")
+        print(f"Empty folders removed: {removed}")
+    
+    def _resume_jobs(self, jobs: Iterable[Tuple[Path, str, Path, int]]
+                     ) -> Iterator[Tuple[Path, str, Path, int]]:
+        """Drop jobs a resumed journal shows as done; reuse journaled names"""
+        for file_path, category, destination, size in jobs:
+            key = str(file_path)
+            if key in self._resume_done:
+                self._bump('resumed')
+                continue
+            if key in self._resume_pending:
+                destination = Path(self._resume_pending.pop(key))
+            yield file_path, category, destination, size
+    
+    def _bump(self, key: str, amount: int = 1) -> None:
+        """Increment a counter in self.stats (safe to call from move threads)"""
+        with self._stats_lock:
+            self.stats[key] += amount
+    
+    def merge_stats(self, other: Dict) -> None:
+        """Add the stats of another sorter (e.g. a shard worker) to this one"""
+        with self._stats_lock:
+            for key, value in other.items():
+                if isinstance(value, set):
+                    self.stats[key] |= value
+                elif isinstance(value, dict):
+                    for name, count in value.items():
+                        self.stats[key][name] = self.stats[key].get(name, 0) + count
+                else:
+                    self.stats[key] += value
+    
+    def _rebuild_extension_index(self) -> None:
+        """Rebuild the extension -> category index from file_categories"""
+        index = {}
+        for category, extensions in self.file_categories.items():
+            for extension in extensions:
+                # Earlier categories win, as with the old linear scan
+                index.setdefault(extension.lower(), category)
+        
+        self._extension_index = index
+        self._max_extension_parts = max((ext.count('.') for ext in index), default=1)
+    
+    def set_category(self, category: str, extensions: Iterable[str]) -> None:
+        """Create or replace a category with the given extensions (e.g. '.tar.gz')"""
+        self.file_categories[category] = {ext.lower() for ext in extensions}
+        self._rebuild_extension_index()
+    
+    def add_extensions(self, category: str, extensions: Iterable[str]) -> None:
+        """Add extensions to a category, creating it if needed"""
+        self.file_categories.setdefault(category, set()).update(ext.lower() for ext in extensions)
+        self._rebuild_extension_index()
+    
+    def remove_category(self, category: str) -> None:
+        """Remove a category; its extensions fall back to extension-named folders"""
+        self.file_categories.pop(category, None)
+        self._rebuild_extension_index()
+    
+    def set_exclude(self, patterns: Iterable[str]) -> None:
+        """Set the directory exclude globs, compiled into a single regex"""
+        self.exclude = list(patterns)
+        if self.exclude:
+            self._exclude_re = re.compile('|'.join(fnmatch.translate(pattern.rstrip('/\\'))
+                                                   for pattern in self.exclude))
+        else:
+            self._exclude_re = None
+    
+    def directory_pruner(self) -> Callable[[str, str], bool]:
+        """Return the prune(path, name) check used by recursive scans
+        
+        Prunes the target's category folders, so a run whose target is
+        inside the source never walks back into files it has sorted, plus
+        any directory matching an exclude glob. Category folders named after
+        unknown extensions are pruned too: those this run has used, and
+        those holding the CATEGORY_MARKER an earlier run left in them.
+        """
+        target = str(self.target_dir)
+        category_dirs = {os.path.join(target, category)
+                         for category in self._configured_categories()}
+        known_folders = self._known_folders
+        exclude = self._exclude_re
+        metrics = self.metrics
+        source_len = len(str(self.source_dir)) + 1
+        
+        def marked(path: str) -> bool:
+            if metrics is not None:
+                metrics.syscall('stat')
+            return os.path.lexists(os.path.join(path, CATEGORY_MARKER))
+        
+        def prune(path: str, name: str) -> bool:
+            if path in category_dirs or path in known_folders:
+                pruned = True
+            elif os.path.dirname(path) == target and marked(path):
+                pruned = True
+            elif exclude is not None:
+                relative = path[source_len:].replace(os.sep, '/')
+                pruned = bool(exclude.match(name) or exclude.match(relative))
+            else:
+                pruned = False
+            if pruned:
+                self.stats['dirs_pruned'] += 1
+            return pruned
+        
+        return prune
+    
+    def _configured_categories(self) -> List[str]:
+        """Categories named by the configuration rather than by an extension"""
+        categories = list(self.file_categories) + ['NO_EXTENSION', DUPLICATES_FOLDER]
+        if self.rules is not None:
+            categories.extend(self.rules.categories)
+        categories.extend(pattern.category for pattern in self.name_patterns
+                          if pattern.action == 'route')
+        return categories
     
     def get_file_category(self, file_extension: str) -> str:
         """Determine the category for a file based on its extension"""
-        file_extension = file_extension.lower()
+        category = self._extension_index.get(file_extension)
+        if category is not None:
+            return category
         
-        for category, extensions in self.file_categories.items():
-            if file_extension in extensions:
-                return category
+        file_extension = file_extension.lower()
+        category = self._extension_index.get(file_extension)
+        if category is not None:
+            return category
         
         # If no category found, use the extension name (without dot)
         return file_extension[1:].upper() if file_extension else 'NO_EXTENSION'
     
-    def should_skip_file(self, file_path: Path) -> bool:
-        """Check if a file should be skipped"""
-        # Skip hidden files (starting with .)
-        if file_path.name.startswith('.') and file_path.name not in self.skip_files:
-            return True
+    def get_category_for_name(self, file_name: str) -> str:
+        """Determine the category for a file name
+        
+        Multi-part extensions in the index (like '.tar.gz') are tried first,
+        longest first; otherwise this is get_file_category on the last suffix.
+        """
+        if self._max_extension_parts > 1:
+            parts = file_name.lower().split('.')
+            # Leave at least one non-empty part for the stem
+            longest = min(self._max_extension_parts, len(parts) - 1 if parts[0] else len(parts) - 2)
+            for count in range(longest, 1, -1):
+                category = self._extension_index.get('.' + '.'.join(parts[-count:]))
+                if category is not None:
+                    return category
+        
+        i = file_name.rfind('.')
+        return self.get_file_category(file_name[i:] if 0 < i < len(file_name) - 1 else '')
+    
+    def set_rules(self, rules: Iterable[Rule]) -> None:
+        """Replace the routing rules (see parse_rule); an empty list disables them"""
+        rules = list(rules)
+        self.rules = RuleSet(rules) if rules else None
+    
+    def classify(self, entry: ScanEntry) -> str:
+        """Determine the category for a scanned file
+        
+        A matching 'route' name pattern wins, then the first matching
+        routing rule. Otherwise this is
+        get_category_for_name, except that with a sniffer enabled a file
+        with no extension or an ambiguous one is classified by content when
+        its leading bytes are recognized.
+        """
+        if self._name_matcher.routes:
+            pattern = self._name_matcher.match(entry.name)
+            if pattern is not None and pattern.action == 'route':
+                self._bump('rule_matches')
+                return pattern.category
+        
+        if self.rules is not None:
+            category = self.rules.match(entry)
+            if category is not None:
+                self._bump('rule_matches')
+                return category
+        
+        if self.sniffer is not None:
+            suffix = entry.suffix.lower()
+            if not suffix or suffix in AMBIGUOUS_EXTENSIONS:
+                category = self.sniffer.sniff(entry)
+                if category is not None:
+                    self._bump('sniffed')
+                    return category
+        return self.get_category_for_name(entry.name)
+    
+    def set_name_patterns(self, patterns: Iterable[NamePattern]) -> None:
+        """Replace the user name patterns and recompile the name matcher
+        
+        The built-in skips follow the user patterns: hidden files, names in
+        skip_files, extensions in skip_extensions (any case) and this script.
+        """
+        self.name_patterns = list(patterns)
+        builtin = [NamePattern('skip', 're:' + re.escape(name)) for name in sorted(self.skip_files)]
+        builtin.append(NamePattern('skip', '.*'))
+        builtin.extend(NamePattern('skip', f're:(?i:.*{re.escape(extension)})')
+                       for extension in sorted(self.skip_extensions))
+        builtin.append(NamePattern('skip', 'file_sorter.py'))
+        self._name_matcher = NameMatcher(self.name_patterns + builtin)
+    
+    def add_name_pattern(self, action: str, pattern: str, category: str = None) -> None:
+        """Append one user name pattern (see NamePattern)"""
+        if action not in NAME_PATTERN_ACTIONS:
+            raise ValueError(f"Unknown pattern action: {action}")
+        self.set_name_patterns(self.name_patterns + [NamePattern(action, pattern, category)])
+    
+    def should_skip_file(self, file_path) -> bool:
+        """Check if a file should be skipped (accepts a Path or ScanEntry)"""
+        pattern = self._name_matcher.match(file_path.name)
+        return pattern is not None and pattern.action == 'skip'
+    
+    def _ensure_folder(self, folder_path: Path) -> Path:
+        """Create a folder unless it is already known to exist
+        
+        Folders already created or seen are remembered, so only the first
+        file going to each folder touches the filesystem. If a remembered
+        folder is deleted later, _transfer calls _forget_folder and this
+        again when a move into it fails.
+        """
+        key = str(folder_path)
+        if key not in self._known_folders:
+            if self.metrics is not None:
+                started = time.perf_counter()
+                folder_path.mkdir(parents=True, exist_ok=True)
+                self.metrics.add('mkdir', time.perf_counter() - started)
+                self.metrics.syscall('mkdir')
+            else:
+                folder_path.mkdir(parents=True, exist_ok=True)
+            self._known_folders.add(key)
+        return folder_path
+    
+    def _forget_folder(self, folder_path: Path) -> None:
+        """Drop what is cached about a folder that has disappeared"""
+        key = str(folder_path)
+        with self._names_lock:
+            self._known_folders.discard(key)
+            self._name_registries.pop(key, None)
+    
+    def create_category_folder(self, category: str, entry: ScanEntry = None) -> Path:
+        """Create a folder for the given category
+        
+        With a sharded layout and an entry, the shard folder chosen for
+        that file (see shard_folder) is created and returned instead.
+        """
+        if entry is not None:
+            folder_path = self._ensure_folder(self.shard_folder(category, entry))
+        else:
+            folder_path = self._ensure_folder(self.target_dir / category)
+        self._use_category(category)
+        return folder_path
+    
+    def _use_category(self, category: str) -> None:
+        """Count a category as used, once its folder exists
+        
+        A folder named after an unknown extension gets a CATEGORY_MARKER,
+        so directory_pruner can tell it from a user's own folder later.
+        """
+        self.stats['categories_created'].add(category)
+        if category in self._marked_categories:
+            return
+        self._marked_categories.add(category)
+        if category in self._configured_categories():
+            return
+        if self.metrics is not None:
+            self.metrics.syscall('open')
+        try:
+            os.close(os.open(str(self.target_dir / category / CATEGORY_MARKER),
+                             os.O_CREAT | os.O_WRONLY, 0o644))
+        except OSError:
+            pass
+    
+    def _shard_key(self, entry: ScanEntry) -> str:
+        """Relative shard folder for a file under the current layout"""
+        if self.layout == 'date':
+            return datetime.fromtimestamp(entry.mtime).strftime('%Y/%m')
+        if self.layout == 'prefix':
+            stem = split_name(entry.name)[0].lower()[:SHARD_PREFIX_LENGTH]
+            return ''.join(c if c.isalnum() else '_' for c in stem) or '_'
+        return f"{zlib.crc32(entry.name.encode('utf-8', 'surrogateescape')) & 0xff:02x}"
+    
+    def shard_folder(self, category: str, entry: ScanEntry) -> Path:
+        """Return the folder a file goes to inside its category folder
+        
+        The flat category folder when no layout is set. Otherwise the
+        file's shard, or the first spill-over of it with room left. Fill
+        levels come from the shard's NameRegistry, which counts names
+        already handed out in memory, so no directory is listed per file.
+        """
+        folder = self.target_dir / category
+        if self.layout is None:
+            return folder
+        
+        base = folder / self._shard_key(entry)
+        key = str(base)
+        spill = self._shard_spill.get(key, 0)
+        while True:
+            candidate = base if spill == 0 else base.with_name(f"{base.name}.{spill}")
+            if len(self._registry(str(candidate)).names) < self.max_entries:
+                break
+            spill += 1
+        self._shard_spill[key] = spill
+        return candidate
+    
+    def prepare_category_folders(self, categories: Iterable[str]) -> None:
+        """Create every folder a planned run needs in one batch
+        
+        One scandir of the target finds the folders that already exist;
+        only the missing ones are created.
+        """
+        wanted = {str(self.target_dir / category) for category in categories}
+        wanted -= self._known_folders
+        if not wanted:
+            return
+        
+        try:
+            with os.scandir(str(self.target_dir)) as it:
+                for entry in it:
+                    if entry.path in wanted and entry.is_dir():
+                        self._known_folders.add(entry.path)
+                        wanted.discard(entry.path)
+        except FileNotFoundError:
+            pass
+        
+        for folder in wanted:
+            self._ensure_folder(Path(folder))
+    
+    def resolve_destination(self, destination: Path) -> Path:
+        """Return destination, or a free name_N variant if it is taken
+        
+        Names come from a NameRegistry per destination folder, so a conflict
+        is resolved in memory and names handed to moves still in flight are
+        never reused. The registry only knows what was in the folder when it
+        was seeded; _transfer never overwrites a file, and comes back here
+        for the next name if one has appeared on disk since.
+        """
+        if self.metrics is None:
+            return self._allocate_destination(destination)
+        started = time.perf_counter()
+        try:
+            return self._allocate_destination(destination)
+        finally:
+            self.metrics.add('collision', time.perf_counter() - started)
+    
+    def _allocate_destination(self, destination: Path) -> Path:
+        """resolve_destination without the timing"""
+        folder = destination.parent
+        registry = self._registry(str(folder))
+        
+        with self._names_lock:
+            # A name kept for an unfinished move from a resumed journal
+            if self._reserved and str(destination) in self._reserved:
+                self._reserved.discard(str(destination))
+                registry.add(destination.name)
+                return destination
+            
+            while True:
+                candidate = folder / registry.allocate(destination.name)
+                if not self._reserved or str(candidate) not in self._reserved:
+                    return candidate
+    
+    def _registry(self, folder: str) -> NameRegistry:
+        """Return the NameRegistry for a destination folder, seeding it once"""
+        with self._names_lock:
+            registry = self._name_registries.get(folder)
+            if registry is None:
+                registry = self._name_registries[folder] = NameRegistry(folder)
+                if self.metrics is not None:
+                    self.metrics.syscall('scandir')
+            return registry
+    
+    def _release_name(self, destination: Path) -> None:
+        """Give a name back to its folder's registry after a failed move"""
+        with self._names_lock:
+            registry = self._name_registries.get(str(destination.parent))
+            if registry is not None:
+                registry.discard(destination.name)
+    
+    def move_strategy(self, source_dir: Path, destination_dir: Path) -> str:
+        """Pick how to move files between two directories
+        
+        'rename' when both are on the same device (st_dev), else 'copy'.
+        Decided once per directory pair.
+        """
+        key = (str(source_dir), str(destination_dir))
+        strategy = self._strategies.get(key)
+        if strategy is None:
+            same_device = self._device_of(source_dir) == self._device_of(destination_dir)
+            strategy = 'rename' if same_device else 'copy'
+            self._strategies[key] = strategy
+        return strategy
+    
+    def _rename_no_clobber(self, source: str, destination: str) -> None:
+        """Rename a file, raising FileExistsError rather than replace another
+        
+        A plain rename silently overwrites an existing destination on POSIX.
+        On Linux renameat2 with RENAME_NOREPLACE does the whole job in one
+        syscall. Elsewhere, or where a filesystem does not support the
+        flag, a hard link to the new name fails atomically if it is taken,
+        and the old name is unlinked after it; a crash in between leaves two
+        links to the same data, never a lost file. Where links are not
+        available either (see NO_LINK_ERRNOS, or no linkat to link a symlink
+        itself), the name is claimed with an O_EXCL create and the file
+        renamed over it.
+        """
+        metrics = self.metrics
+        if metrics is not None and _renameat2 is not None:
+            metrics.syscall('renameat2')
+        if rename_no_replace(source, destination):
+            return
+        
+        if os.link in os.supports_follow_symlinks:
+            if metrics is not None:
+                metrics.syscall('link')
+            try:
+                os.link(source, destination, follow_symlinks=False)
+            except FileExistsError:
+                raise
+            except OSError as e:
+                if e.errno not in NO_LINK_ERRNOS:
+                    raise
+            else:
+                if metrics is not None:
+                    metrics.syscall('unlink')
+                try:
+                    os.unlink(source)
+                except OSError:
+                    os.unlink(destination)
+                    raise
+                return
+        
+        if metrics is not None:
+            metrics.syscall('open')
+        os.close(os.open(destination, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+        if metrics is not None:
+            metrics.syscall('rename')
+        try:
+            os.replace(source, destination)
+        except OSError:
+            os.unlink(destination)
+            raise
+    
+    def _copy_then_unlink(self, source: Path, destination: Path) -> int:
+        """Cross-device move: copy data and metadata, then remove the source
         
-        # Skip specific files
-        if file_path.name in self.skip_files:
-            return True
+        The data goes to a hidden name beside the destination (see
+        _copy_temp_path), created with O_EXCL, and only a complete copy is
+        given the final name, through the same no-clobber rename as a
+        same-device move. So an existing file is never overwritten
+        (FileExistsError is raised instead) and a partial copy never sits
+        at the final name. Returns the number of bytes copied. A failed
+        copy is cleaned up so the source stays the only copy.
+        """
+        metrics = self.metrics
+        if source.is_symlink():
+            # Recreate the link rather than copy its target
+            os.symlink(os.readlink(str(source)), str(destination))
+            try:
+                os.unlink(str(source))
+            except OSError:
+                os.unlink(str(destination))
+                raise
+            if metrics is not None:
+                metrics.syscall('symlink')
+                metrics.syscall('unlink')
+            return 0
         
-        # Skip specific extensions
-        if file_path.suffix.lower() in self.skip_extensions:
-            return True
+        if os.path.lexists(str(destination)):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), str(destination))
+        temporary = _copy_temp_path(str(destination))
+        if metrics is not None:
+            metrics.syscall('open')
+        os.close(os.open(temporary, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+        try:
+            size = copy_file_fast(str(source), temporary, metrics)
+            shutil.copystat(str(source), temporary)
+            self._rename_no_clobber(temporary, str(destination))
+        except BaseException:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+            raise
+        try:
+            os.unlink(str(source))
+        except OSError:
+            os.unlink(str(destination))
+            raise
+        if metrics is not None:
+            metrics.syscall('unlink')
+        return size
+    
+    def _restore_copy(self, link: Path, destination: Path):
+        """Undo a hardlink dedup placement as an independent copy
         
-        # Skip if it's the script itself
-        if file_path.name == 'file_sorter.py':
-            return True
+        The link shares its data with the original, so moving it back
+        would leave the restored file tied to it. Returns destination, or
+        None on failure.
+        """
+        try:
+            self._copy_then_unlink(link, destination)
+        except Exception as e:
+            self.reporter.error(str(link), e)
+            self._bump('errors')
+            return None
+        return destination
+    
+    def _place(self, source: Path, destination: Path, strategy: str) -> Tuple[str, int]:
+        """Move a file with the given strategy, never over an existing one
         
-        return False
+        Returns the strategy actually used and the bytes copied; raises
+        FileExistsError if destination is taken.
+        """
+        if strategy == 'rename':
+            try:
+                self._rename_no_clobber(str(source), str(destination))
+                return strategy, 0
+            except OSError as e:
+                # e.g. bind mounts that share a device number
+                if e.errno != errno.EXDEV:
+                    raise
+        return 'copy', self._copy_then_unlink(source, destination)
     
-    def create_category_folder(self, category: str) -> Path:
-        """Create a folder for the given category"""
-        folder_path = self.target_dir / category
-        folder_path.mkdir(exist_ok=True)
-        self.stats['categories_created'].add(category)
-        return folder_path
+    def _transfer(self, source: Path, destination: Path, next_name: bool = True):
+        """Move source to an already resolved destination
+        
+        An existing file is never replaced. If the name turns out to be
+        taken on disk (a file put there after the folder's registry was
+        seeded, another process, or a name differing only in case on a
+        case-insensitive filesystem), the next free name is resolved and the
+        move retried; with next_name false the move fails instead. If the
+        destination folder was deleted since it was created, it is created
+        again and the move retried once. Returns the path the file ended up
+        at, or None if it was not moved.
+        """
+        journal = self.journal
+        metrics = self.metrics
+        started = time.perf_counter()
+        recreated = False
+        try:
+            strategy = self.move_strategy(source.parent, destination.parent)
+            while True:
+                if journal is not None:
+                    journal.intent(str(source), str(destination))
+                try:
+                    strategy, copied = self._place(source, destination, strategy)
+                    break
+                except FileExistsError:
+                    if not next_name:
+                        raise
+                    destination = self.resolve_destination(destination.with_name(source.name))
+                except FileNotFoundError:
+                    # A missing source is an error; a missing folder was
+                    # removed while cached (e.g. during --watch)
+                    if recreated or os.path.isdir(str(destination.parent)):
+                        raise
+                    recreated = True
+                    self._forget_folder(destination.parent)
+                    self._ensure_folder(destination.parent)
+            
+            with self._stats_lock:
+                strategies = self.stats['strategies']
+                strategies[strategy] = strategies.get(strategy, 0) + 1
+                self.stats['bytes_copied'] += copied
+            if journal is not None:
+                journal.done(str(source))
+            if self.undo_log is not None:
+                self.undo_log.record(str(source), str(destination))
+            if self._moved_to is not None:
+                self._moved_to[str(source)] = str(destination)
+            if metrics is not None:
+                metrics.add('move', time.perf_counter() - started)
+            return destination
+            
+        except Exception as e:
+            self.reporter.error(str(source), e)
+            self._bump('errors')
+            if journal is not None:
+                journal.failed(str(source))
+            self._release_name(destination)
+            if self.index is not None:
+                self.index.forget_directory(str(source.parent))
+            if metrics is not None:
+                metrics.add('move', time.perf_counter() - started)
+            return None
     
     def move_file_safely(self, source: Path, destination: Path) -> bool:
         """Move file with conflict resolution"""
+        return self._transfer(source, self.resolve_destination(destination)) is not None
+    
+    def _device_of(self, directory: Path) -> int:
+        """st_dev of a directory, stat'ed once per directory"""
+        key = str(directory)
+        device = self._dir_devices.get(key)
+        if device is None:
+            if self.metrics is not None:
+                self.metrics.syscall('stat')
+            device = os.stat(key).st_dev
+            self._dir_devices[key] = device
+        return device
+    
+    def _transfer_limited(self, source: Path, destination: Path, devices: List[int]):
+        """Run _transfer while holding a slot on each device involved
+        
+        Slots are always taken in ascending device order so two moves going
+        in opposite directions between the same devices cannot deadlock.
+        """
+        slots = [self._device_slots[device] for device in devices]
+        for slot in slots:
+            slot.acquire()
         try:
-            # If destination exists, add a number suffix
-            if destination.exists():
-                counter = 1
-                stem = destination.stem
-                suffix = destination.suffix
-                parent = destination.parent
-                
-                while destination.exists():
-                    new_name = f"{stem}_{counter}{suffix}"
-                    destination = parent / new_name
-                    counter += 1
+            return self._transfer(source, destination)
+        finally:
+            for slot in reversed(slots):
+                slot.release()
+    
+    def iter_sortable_files(self, recursive: bool = False) -> Iterator[ScanEntry]:
+        """Pipeline stage 1: scan the source directory, dropping skipped files"""
+        if self.index is not None:
+            entries = self._iter_indexed_files(recursive)
+        else:
+            entries = (entry for entry in scan_files(self.source_dir, recursive,
+                                                     self.directory_pruner(), self.metrics)
+                       if not self.should_skip_file(entry))
+        
+        if self.metrics is not None:
+            return self.metrics.timed('scan', entries)
+        return entries
+    
+    def _iter_indexed_files(self, recursive: bool) -> Iterator[ScanEntry]:
+        """scan_files guided by the ScanIndex
+        
+        Directories unchanged since the last run are not listed at all.
+        """
+        root = str(self.source_dir)
+        prune = self.directory_pruner()
+        metrics = self.metrics
+        pending = [root]
+        
+        while pending:
+            current = pending.pop()
+            if metrics is not None:
+                metrics.syscall('stat')
+            try:
+                info = os.stat(current)
+            except OSError:
+                if current == root:
+                    raise
+                continue
+            
+            subdirs = self.index.unchanged_subdirs(current, info)
+            if subdirs is not None:
+                self.stats['dirs_unchanged'] += 1
+                if recursive:
+                    pending.extend(path for path in subdirs
+                                   if not prune(path, os.path.basename(path)))
+                continue
             
-            shutil.move(str(source), str(destination))
-            return True
+            subdirs = []
+            if metrics is not None:
+                metrics.syscall('scandir')
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_file():
+                                scan = ScanEntry(entry, metrics)
+                                if self.should_skip_file(scan):
+                                    continue
+                                yield scan
+                            elif entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.path)
+                        except OSError:
+                            continue
+            except OSError:
+                if current == root:
+                    raise
+                continue
             
-        except Exception as e:
-            print(f"Error moving {source.name}: {e}")
-            self.stats['errors'] += 1
-            return False
+            # The full list is recorded so changing excludes takes effect
+            self.index.record_directory(current, info, subdirs)
+            if recursive:
+                pending.extend(path for path in subdirs
+                               if not prune(path, os.path.basename(path)))
     
-    def sort_files(self, dry_run: bool = False) -> None:
-        """Main sorting function"""
-        print(f"{'DRY RUN: ' if dry_run else ''}Sorting files in: {self.source_dir}")
-        print(f"Target directory: {self.target_dir}")
-        print("-" * 50)
+    def classify_files(self, entries: Iterable[ScanEntry]) -> Iterator[Tuple[ScanEntry, str]]:
+        """Pipeline stage 2: pair each file with its category"""
+        if self.metrics is None:
+            for entry in entries:
+                yield entry, self.classify(entry)
+            return
         
-        # Get all files in source directory (non-recursive by default)
-        files_to_sort = [f for f in self.source_dir.iterdir() 
-                        if f.is_file() and not self.should_skip_file(f)]
+        clock = time.perf_counter
+        add = self.metrics.add
+        for entry in entries:
+            started = clock()
+            category = self.classify(entry)
+            add('classify', clock() - started)
+            yield entry, category
+    
+    def _move_jobs(self, classified: Iterable[Tuple[ScanEntry, str]]
+                   ) -> Iterator[Tuple[Path, str, Path, ScanEntry]]:
+        """Turn classified files into (source, category, destination, entry) jobs
         
-        if not files_to_sort:
-            print("No files to sort!")
-            return
+        Files that already sit in their category folder (or, with a sharded
+        layout, anywhere below it) are passed over, so a streaming walk that
+        reaches freshly sorted files leaves them alone. The ScanEntry comes
+        along for callers that want its cached stat.
+        """
+        for entry, category in classified:
+            file_path = entry.to_path()
+            folder = self.target_dir / category
+            
+            if file_path.parent == folder or (
+                    self.layout is not None and folder in file_path.parents):
+                continue
+            
+            destination = self.shard_folder(category, entry) / file_path.name
+            yield file_path, category, destination, entry
+    
+    def _result_size(self, entry: ScanEntry):
+        """Size for a moved file's MoveResult, from the entry's cached stat
         
-        print(f"Found {len(files_to_sort)} files to sort")
-        print()
+        None unless the reporter shows bytes, so quiet and plain runs never
+        stat a file just for its size.
+        """
+        if not self.reporter.needs_sizes:
+            return None
+        try:
+            return entry.size
+        except OSError:
+            return None
+    
+    def dedup_files(self, classified: List[Tuple[ScanEntry, str]], dry_run: bool = False,
+                    results: List[MoveResult] = None) -> List[Tuple[ScanEntry, str]]:
+        """Dedup stage: drop or divert files whose content is already present
+        
+        Candidates are compared with each other and with the files already
+        in the category folders they are headed for (see find_duplicates).
+        Returns the classified list to move. 'skip' leaves duplicates where
+        they are; 'quarantine' sends them to DUPLICATES_FOLDER instead of
+        their category; 'hardlink' holds them back for link_duplicates.
+        Each duplicate is reported, and appended to results if given, as a
+        'duplicate' MoveResult.
+        """
+        if self.dedup is None:
+            return classified
+        
+        candidates = []
+        folders = set()
+        for entry, category in classified:
+            folder = os.path.join(str(self.target_dir), category)
+            folders.add(folder)
+            parent = os.path.dirname(entry.path)
+            if parent != folder and not (self.layout is not None
+                                         and parent.startswith(folder + os.sep)):
+                candidates.append(entry)
+        
+        existing = []
+        for folder in folders:
+            try:
+                existing.extend(scan_files(folder, self.layout is not None, metrics=self.metrics))
+            except OSError:
+                pass
+        
+        duplicates = find_duplicates(candidates, existing)
+        if not duplicates:
+            return classified
         
-        for file_path in files_to_sort:
-            category = self.get_file_category(file_path.suffix)
+        if self.dedup == 'hardlink':
+            self._moved_to = {}
+        
+        kept = []
+        for entry, category in classified:
+            original = duplicates.get(entry.path)
+            if original is None:
+                kept.append((entry, category))
+                continue
             
+            self._bump('duplicates')
+            record = MoveResult(entry.path, original, category, 'duplicate')
+            self.reporter.result(record)
+            if results is not None:
+                results.append(record)
+            if self.dedup == 'quarantine':
+                kept.append((entry, DUPLICATES_FOLDER))
+            elif self.dedup == 'hardlink':
+                self._pending_links.append((entry, category, original))
+        return kept
+    
+    def link_duplicates(self, dry_run: bool = False) -> Iterator[MoveResult]:
+        """Finish hardlink dedup after the originals have been moved
+        
+        Each held-back duplicate becomes a hard link to its original, at
+        the name it would have been moved to, and the source copy is
+        removed. A duplicate whose original failed to move, or that cannot
+        be linked (e.g. across devices), is moved normally instead; one
+        whose source cannot be removed is left where it was and counted as
+        an error. Placements are journaled like moves, with the original
+        in the intent, and marked as links in the undo log. Yields a
+        MoveResult per duplicate.
+        """
+        pending, self._pending_links = self._pending_links, []
+        moved_to = self._moved_to or {}
+        journal = self.journal
+        
+        for entry, category, original in pending:
+            file_path = entry.to_path()
+            original = moved_to.get(original, original)
             if dry_run:
-                print(f"Would move: {file_path.name} → {category}/")
+                record = MoveResult(entry.path, original, category, 'would_link')
+                self.reporter.result(record)
+                yield record
+                continue
+            
+            wanted = self.shard_folder(category, entry) / file_path.name
+            size = self._result_size(entry)
+            if not os.path.exists(original):
+                yield from self.run_moves([(file_path, category, wanted, size)])
+                continue
+            if entry.path in self._resume_done:
+                self._bump('resumed')
+                continue
+            if entry.path in self._resume_pending:
+                wanted = Path(self._resume_pending.pop(entry.path))
+            
+            self._ensure_folder(wanted.parent)
+            self._use_category(category)
+            destination = self.resolve_destination(wanted)
+            try:
+                while True:
+                    if journal is not None:
+                        journal.intent(entry.path, str(destination), original)
+                    try:
+                        os.link(original, str(destination))
+                        break
+                    except FileExistsError:
+                        # Taken on disk since the registry was seeded
+                        destination = self.resolve_destination(wanted)
+            except OSError:
+                if journal is not None:
+                    journal.failed(entry.path)
+                self._release_name(destination)
+                yield from self.run_moves([(file_path, category, wanted, size)])
+                continue
+            
+            try:
+                os.unlink(entry.path)
+            except OSError as e:
+                # The source stays the only name it has; drop the new link
+                os.unlink(str(destination))
+                self._release_name(destination)
+                if journal is not None:
+                    journal.failed(entry.path)
+                if self.index is not None:
+                    self.index.forget_directory(str(file_path.parent))
+                self.reporter.error(entry.path, e)
+                self._bump('errors')
+                self._bump('skipped')
+                record = MoveResult(entry.path, str(destination), category, 'failed')
+                self.reporter.result(record)
+                yield record
                 continue
             
+            if journal is not None:
+                journal.done(entry.path)
+            if self.undo_log is not None:
+                self.undo_log.record(entry.path, str(destination), linked=True)
+            with self._stats_lock:
+                strategies = self.stats['strategies']
+                strategies['hardlink'] = strategies.get('hardlink', 0) + 1
+                self.stats['moved'] += 1
+            record = MoveResult(entry.path, str(destination), category, 'linked', size)
+            self.reporter.result(record)
+            yield record
+        
+        self._moved_to = None
+    
+    def move_files(self, classified: Iterable[Tuple[ScanEntry, str]],
+                   dry_run: bool = False) -> Iterator[MoveResult]:
+        """Pipeline stage 3: move each classified file into its category folder
+        
+        Yields a MoveResult as each file is handled.
+        """
+        jobs = self._move_jobs(classified)
+        
+        if dry_run:
+            for file_path, category, destination, _ in jobs:
+                record = MoveResult(str(file_path), str(destination), category, 'would_move')
+                self.reporter.result(record)
+                yield record
+            return
+        
+        yield from self.run_moves((file_path, category, destination, self._result_size(entry))
+                                  for file_path, category, destination, entry in jobs)
+    
+    def _finish_move(self, file_path: Path, category: str, destination: Path,
+                     size, placed: Path) -> MoveResult:
+        """Count and report one finished move job (placed is None if it failed)"""
+        if placed is not None:
+            self._bump('moved')
+            record = MoveResult(str(file_path), str(placed), category, 'moved', size)
+        else:
+            self._bump('skipped')
+            record = MoveResult(str(file_path), str(destination), category, 'failed')
+        self.reporter.result(record)
+        return record
+    
+    def run_moves(self, jobs: Iterable[Tuple[Path, str, Path, int]]) -> Iterator[MoveResult]:
+        """Carry out (source, category, destination, size) move jobs
+        
+        The destination folder is created if needed and the name goes
+        through resolve_destination, so a taken name gets a number suffix.
+        Uses the thread pool when workers > 1. Yields a MoveResult per job;
+        size (may be None) is only passed on to it.
+        """
+        if self._resume_done or self._resume_pending:
+            jobs = self._resume_jobs(jobs)
+        
+        if self.workers > 1:
+            yield from self._run_moves_parallel(jobs)
+            return
+        
+        for file_path, category, destination, size in jobs:
             # Create category folder
-            category_folder = self.create_category_folder(category)
-            destination = category_folder / file_path.name
+            self._ensure_folder(destination.parent)
+            self._use_category(category)
             
             # Move the file
-            if self.move_file_safely(file_path, destination):
-                print(f"Moved: {file_path.name} → {category}/")
-                self.stats['moved'] += 1
-            else:
-                self.stats['skipped'] += 1
+            destination = self.resolve_destination(destination)
+            placed = self._transfer(file_path, destination)
+            yield self._finish_move(file_path, category, destination, size, placed)
+    
+    def _run_moves_parallel(self, jobs: Iterable[Tuple[Path, str, Path, int]]
+                            ) -> Iterator[MoveResult]:
+        """Thread-pool version of run_moves
+        
+        Folder creation and name resolution stay on the calling thread, in
+        input order, so collision names come out the same as in a
+        sequential run and a name is never handed to two moves. Only the
+        moves themselves go to the pool, with at most device_limit running
+        against any one device and a bounded number queued so streaming
+        input keeps its memory bound.
+        """
+        window = self.workers * 4
+        pending = {}
+        
+        def finish(future):
+            return self._finish_move(*pending.pop(future), future.result())
+        
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for file_path, category, destination, size in jobs:
+                folder = self._ensure_folder(destination.parent)
+                self._use_category(category)
+                destination = self.resolve_destination(destination)
+                
+                devices = sorted({self._device_of(file_path.parent),
+                                  self._device_of(folder)})
+                for device in devices:
+                    if device not in self._device_slots:
+                        self._device_slots[device] = threading.BoundedSemaphore(self.device_limit)
+                
+                future = pool.submit(self._transfer_limited, file_path, destination, devices)
+                pending[future] = (file_path, category, destination, size)
+                
+                if len(pending) >= window:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield finish(future)
+            
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield finish(future)
+    
+    def iter_plan(self, recursive: bool = False) -> Iterator[MoveOp]:
+        """Scan and classify the source without moving anything
+        
+        Yields a MoveOp per file that would be moved. Collision names are
+        resolved against this sorter's name registries, so a plan is
+        internally consistent; the size comes from the scan entry's cached
+        stat, which classification may already have fetched. A file that
+        has gone by then is reported as an error and left out.
+        """
+        jobs = self._move_jobs(self.classify_files(self.iter_sortable_files(recursive)))
+        for file_path, category, destination, entry in jobs:
+            try:
+                size = entry.size
+            except OSError as e:
+                self.reporter.error(str(file_path), e)
+                self._bump('errors')
+                continue
+            destination = self.resolve_destination(destination)
+            yield MoveOp(str(file_path), str(destination), category, size)
+    
+    def plan(self, recursive: bool = False) -> List[MoveOp]:
+        """Return the full move plan as a list (see iter_plan)"""
+        return list(self.iter_plan(recursive))
+    
+    def write_plan(self, plan: Iterable[MoveOp], plan_path: str) -> int:
+        """Write a move plan to a JSONL file and return the number of moves
+        
+        The first line holds the source and target roots; each following
+        line is one move with paths relative to those roots. A path ending
+        in .gz is gzip-compressed.
+        """
+        header = {
+            'version': PLAN_VERSION,
+            'source': str(self.source_dir),
+            'target': str(self.target_dir),
+            'created': datetime.now().isoformat(timespec='seconds'),
+        }
+        count = 0
+        with _open_plan(plan_path, 'w') as f:
+            f.write(json.dumps(header) + '\n')
+            for op in plan:
+                record = [os.path.relpath(op.source, header['source']),
+                          os.path.relpath(op.destination, header['target']),
+                          op.category, op.size]
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                count += 1
+        return count
+    
+    def execute(self, plan: Iterable[MoveOp], dry_run: bool = False) -> Iterator[MoveResult]:
+        """Apply a move plan without rescanning the source
+        
+        Destinations are re-checked through fresh name registries, so files
+        that appeared in the target since planning are not overwritten.
+        Sources that have gone away are reported as errors. Yields a
+        MoveResult per move; the plan is read lazily.
+        """
+        # Names reserved while planning in this process must not count as taken
+        self._name_registries.clear()
+        
+        if dry_run:
+            for op in plan:
+                record = MoveResult(op.source, op.destination, op.category, 'would_move')
+                self.reporter.result(record)
+                yield record
+            return
+        
+        yield from self.run_moves((Path(op.source), op.category, Path(op.destination), op.size)
+                                  for op in plan)
+    
+    def execute_plan(self, plan: Iterable[MoveOp], dry_run: bool = False) -> None:
+        """Apply a move plan through execute(), with a header and summary"""
+        self.reporter.message(f"{'DRY RUN: ' if dry_run else ''}Executing move plan for: {self.source_dir}")
+        self.reporter.message(f"Target directory: {self.target_dir}")
+        self.reporter.message("-" * 50)
         
+        for _ in self.execute(plan, dry_run):
+            pass
+        
+        if dry_run:
+            self.reporter.flush()
+        else:
+            self.reporter.summary(self)
+    
+    def iter_results(self, recursive: bool = False, dry_run: bool = False) -> Iterator[MoveResult]:
+        """Scan, classify and move, yielding a MoveResult per file handled
+        
+        The library entry point: nothing is printed unless the reporter
+        prints. Files stream through the pipeline as they are found; with
+        dedup enabled the file list is gathered first, and duplicates are
+        yielded before the moves.
+        """
+        classified = self.classify_files(self.iter_sortable_files(recursive))
+        if self.dedup is None:
+            yield from self.move_files(classified, dry_run)
+            return
+        
+        duplicates = []
+        classified = self.dedup_files(list(classified), dry_run, duplicates)
+        yield from duplicates
         if not dry_run:
-            self.print_summary()
+            self.prepare_category_folders({category for _, category in classified})
+        yield from self.move_files(classified, dry_run)
+        yield from self.link_duplicates(dry_run)
     
-    def sort_files_recursive(self, dry_run: bool = False) -> None:
-        """Sort files recursively through subdirectories"""
-        print(f"{'DRY RUN: ' if dry_run else ''}Recursively sorting files in: {self.source_dir}")
-        print(f"Target directory: {self.target_dir}")
-        print("-" * 50)
+    def sort_files(self, dry_run: bool = False) -> None:
+        """Main sorting function"""
+        report = self.reporter.message
+        report(f"{'DRY RUN: ' if dry_run else ''}Sorting files in: {self.source_dir}")
+        report(f"Target directory: {self.target_dir}")
+        report("-" * 50)
         
-        # Get all files recursively
-        files_to_sort = []
-        for file_path in self.source_dir.rglob('*'):
-            if file_path.is_file() and not self.should_skip_file(file_path):
-                files_to_sort.append(file_path)
+        # Get all files in source directory (non-recursive by default)
+        files_to_sort = list(self.iter_sortable_files())
         
         if not files_to_sort:
-            print("No files to sort!")
+            report("No files to sort!")
             return
         
-        print(f"Found {len(files_to_sort)} files to sort")
-        print()
+        report(f"Found {len(files_to_sort)} files to sort")
+        report("")
+        
+        classified = self.dedup_files(list(self.classify_files(files_to_sort)), dry_run)
+        if not dry_run:
+            self.prepare_category_folders({category for _, category in classified})
+        
+        for _ in self.move_files(classified, dry_run):
+            pass
+        for _ in self.link_duplicates(dry_run):
+            pass
+        
+        if dry_run:
+            self.reporter.flush()
+        else:
+            self.reporter.summary(self)
+    
+    def sort_files_recursive(self, dry_run: bool = False, stream: bool = False,
+                             precount: bool = False) -> None:
+        """Sort files recursively through subdirectories
+        
+        With stream=True the scan, classify and move stages are chained as
+        generators: memory stays bounded and the first move happens as soon
+        as the first file is found. precount adds a scan-only pass up front
+        to print the total, at the cost of walking the tree twice.
+        """
+        report = self.reporter.message
+        report(f"{'DRY RUN: ' if dry_run else ''}Recursively sorting files in: {self.source_dir}")
+        report(f"Target directory: {self.target_dir}")
+        report("-" * 50)
         
-        for file_path in files_to_sort:
-            category = self.get_file_category(file_path.suffix)
+        if stream:
+            if precount:
+                total = sum(1 for _ in self.iter_sortable_files(recursive=True))
+                report(f"Found {total} files to sort")
+                report("")
             
-            if dry_run:
-                print(f"Would move: {file_path.relative_to(self.source_dir)} → {category}/")
-                continue
+            pipeline = self.move_files(
+                self.classify_files(self.iter_sortable_files(recursive=True)), dry_run)
             
-            # Create category folder
-            category_folder = self.create_category_folder(category)
-            destination = category_folder / file_path.name
+            processed = 0
+            for _ in pipeline:
+                processed += 1
+                if processed % STREAM_PROGRESS_INTERVAL == 0:
+                    report(f"... {processed} files processed")
             
-            # Move the file
-            if self.move_file_safely(file_path, destination):
-                print(f"Moved: {file_path.relative_to(self.source_dir)} → {category}/")
-                self.stats['moved'] += 1
-            else:
-                self.stats['skipped'] += 1
+            if not processed:
+                report("No files to sort!")
+                return
+            
+            report(f"\nProcessed {processed} files")
+        else:
+            # Get all files recursively
+            files_to_sort = list(self.iter_sortable_files(recursive=True))
+            
+            if not files_to_sort:
+                report("No files to sort!")
+                return
+            
+            report(f"Found {len(files_to_sort)} files to sort")
+            report("")
+            
+            classified = self.dedup_files(list(self.classify_files(files_to_sort)), dry_run)
+            if not dry_run:
+                self.prepare_category_folders({category for _, category in classified})
+            
+            for _ in self.move_files(classified, dry_run):
+                pass
+            for _ in self.link_duplicates(dry_run):
+                pass
         
-        if not dry_run:
-            self.print_summary()
+        if dry_run:
+            self.reporter.flush()
+        else:
+            self.reporter.summary(self)
+    
+    def _shard_units(self, processes: int, shard_by: str) -> List[Tuple]:
+        """Split the source tree into units of work for sort_files_sharded"""
+        if shard_by == 'hash':
+            return [('hash', str(self.source_dir), index, processes)
+                    for index in range(processes)]
+        
+        # One unit for the files directly in the source directory, then one
+        # per top-level subdirectory; the pool balances them across workers
+        units = [('dir', str(self.source_dir), False)]
+        prune = self.directory_pruner()
+        with os.scandir(str(self.source_dir)) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False) and not prune(entry.path, entry.name):
+                    units.append(('dir', entry.path, True))
+        return units
+    
+    def sort_files_sharded(self, processes: int, shard_by: str = 'top',
+                           dry_run: bool = False) -> None:
+        """Sort recursively using a pool of worker processes
+        
+        shard_by='top' gives each top-level subdirectory (plus the files
+        directly in the source) to a worker. shard_by='hash' gives each of
+        the N workers the files whose relative path hashes to its index;
+        this balances lopsided trees, but every worker walks the whole tree.
+        Workers run their own FileSorter and return their stats, which are
+        merged here for the summary. If a journal or undo log is open, every
+        worker appends to it; a journal resumed by open_journal is replayed
+        only here, and the workers are handed the result.
+        """
+        report = self.reporter.message
+        report(f"{'DRY RUN: ' if dry_run else ''}Recursively sorting files in: {self.source_dir}")
+        report(f"Target directory: {self.target_dir}")
+        report(f"Worker processes: {processes} (sharded by {shard_by})")
+        report("-" * 50)
+        
+        units = self._shard_units(processes, shard_by)
+        options = {'workers': self.workers, 'device_limit': self.device_limit,
+                   'exclude': self.exclude, 'sniff': self.sniffer is not None,
+                   'layout': self.layout, 'max_entries': self.max_entries,
+                   'rules': self.rules.rules if self.rules is not None else (),
+                   'name_patterns': self.name_patterns, 'quiet': not self.reporter.verbose,
+                   'metrics': self.metrics is not None}
+        journal = None
+        if self.journal is not None:
+            # Workers append to the journal themselves; it was replayed (if
+            # resuming) when opened here, and they get the outcome of that
+            journal = (self.journal.path, self._resume_done, self._resume_pending)
+            self.close_journal()
+        # ...and to the undo log, after the header written here; it stays
+        # open so that closing it afterwards drops it if nothing moved
+        undo_path = self.undo_log.path if self.undo_log is not None else None
+        
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(_sort_shard, str(self.source_dir), str(self.target_dir),
+                                   unit, dry_run, options, journal, undo_path)
+                       for unit in units]
+            for future in futures:
+                stats = future.result()
+                metrics = stats.pop('metrics', None)
+                if metrics is not None:
+                    self.metrics.merge(metrics)
+                self.merge_stats(stats)
+        
+        if dry_run:
+            self.reporter.flush()
+        else:
+            self.reporter.summary(self)
+    
+    def watch(self, debounce: float = WATCH_DEBOUNCE, interval: float = WATCH_INTERVAL,
+              use_inotify: bool = True) -> None:
+        """Keep sorting files as they arrive in the source directory
+        
+        Files already present are sorted first, except those modified in
+        the last debounce seconds. After that, inotify (or a PollingWatcher
+        where it is unavailable) reports new files, and a file is only
+        sorted once it has had no new events (or, if found by the first
+        sweep, no changes) for debounce seconds, so files still being
+        written are left alone. The cost
+        follows the rate files arrive at, not the size of the directory.
+        Runs until interrupted, then prints the summary.
+        """
+        report = self.reporter.message
+        report(f"Watching: {self.source_dir}")
+        report(f"Target directory: {self.target_dir}")
+        report("-" * 50)
+        
+        source = str(self.source_dir)
+        watcher = None
+        if use_inotify and InotifyWatcher.available():
+            try:
+                watcher = InotifyWatcher(source)
+            except OSError as e:
+                report(f"inotify unavailable ({e}), polling instead")
+        if watcher is None:
+            watcher = PollingWatcher(source)
+        report(f"Using {'inotify' if isinstance(watcher, InotifyWatcher) else 'polling'}; "
+              f"press Ctrl+C to stop")
+        
+        # Sort what is already there, after the watch is set up so nothing
+        # arriving in between is missed. A file modified within the last
+        # debounce seconds may still be being written: it waits in pending
+        # like a file the watcher reported, timed from its last change.
+        pending = {}
+        
+        def settled(entries):
+            for entry in entries:
+                try:
+                    age = time.time() - entry.stat().st_mtime
+                except OSError:
+                    continue
+                if age < debounce:
+                    pending[entry.name] = time.monotonic() - max(age, 0.0)
+                else:
+                    yield entry
+        
+        for _ in self.move_files(self.classify_files(settled(self.iter_sortable_files()))):
+            pass
+        self.reporter.flush()
+        if self.undo_log is not None:
+            self.undo_log.flush()
+        
+        try:
+            while True:
+                timeout = interval
+                if pending:
+                    timeout = max(0.0, min(interval, debounce - (time.monotonic() - min(pending.values()))))
+                
+                names = watcher.wait(timeout)
+                now = time.monotonic()
+                if names is None:
+                    # Event queue overflowed: fall back to a full sweep
+                    names = [entry.name for entry in scan_files(source)]
+                for name in names:
+                    pending[name] = now
+                
+                ready = [name for name, seen in pending.items() if now - seen >= debounce]
+                if not ready:
+                    continue
+                
+                entries = []
+                for name in ready:
+                    del pending[name]
+                    entry = ScanEntry.from_path(os.path.join(source, name), self.metrics)
+                    if not self.should_skip_file(entry) and os.path.isfile(entry.path):
+                        entries.append(entry)
+                
+                for _ in self.move_files(self.classify_files(entries)):
+                    pass
+                self.reporter.flush()
+                if self.undo_log is not None:
+                    self.undo_log.flush()
+        except KeyboardInterrupt:
+            report("\nStopped watching.")
+        finally:
+            watcher.close()
+        
+        self.reporter.summary(self)
     
     def print_summary(self) -> None:
         """Print sorting statistics"""
@@ -191,20 +3176,66 @@ class FileSorter:
         print(f"Files moved: {self.stats['moved']}")
         print(f"Files skipped: {self.stats['skipped']}")
         print(f"Errors: {self.stats['errors']}")
+        
+        if self.stats['resumed']:
+            print(f"Already done (resumed from journal): {self.stats['resumed']}")
+        
+        if self.stats['duplicates']:
+            print(f"Duplicates ({self.dedup}): {self.stats['duplicates']}")
+        
+        if self.stats['rule_matches']:
+            print(f"Routed by rules: {self.stats['rule_matches']}")
+        
+        if self.stats['sniffed']:
+            print(f"Classified by content: {self.stats['sniffed']}")
+        
+        if self.stats['dirs_pruned']:
+            print(f"Directories pruned (sorted or excluded): {self.stats['dirs_pruned']}")
+        
+        if self.stats['dirs_unchanged']:
+            print(f"Unchanged directories skipped (index): {self.stats['dirs_unchanged']}")
+        
         print(f"Categories created: {len(self.stats['categories_created'])}")
         
         if self.stats['categories_created']:
             print(f"Categories: {', '.join(sorted(self.stats['categories_created']))}")
         
+        if self.stats['strategies']:
+            print("Move strategies:")
+            for strategy, count in sorted(self.stats['strategies'].items()):
+                print(f"  {MOVE_STRATEGIES.get(strategy, strategy)}: {count}")
+            if self.stats['bytes_copied']:
+                print(f"  Bytes copied across devices: {self.stats['bytes_copied']:,}")
+        
+        if self.metrics is not None:
+            print("Phase timings:")
+            for phase in PhaseMetrics.PHASES:
+                print(f"  {phase}: {self.metrics.seconds[phase]:.3f}s ({self.metrics.calls[phase]:,} calls)")
+            syscalls = self.metrics.snapshot_syscalls()
+            print("Syscalls: " + ', '.join(f"{name} {count:,}" for name, count in sorted(syscalls.items())))
+        
         print(f"Completed at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
+    def write_metrics(self, json_path: str = None, prometheus_path: str = None) -> None:
+        """Write the metrics as JSON and/or a Prometheus textfile
+        
+        Each file is written beside its final name and renamed into place,
+        so a collector never reads a half-written file.
+        """
+        for path, text in ((json_path, lambda: json.dumps(self.metrics.to_dict(self.stats), indent=2) + '\n'),
+                           (prometheus_path, lambda: self.metrics.to_prometheus(self.stats))):
+            if path:
+                temporary = f"{path}.tmp"
+                with open(temporary, 'w', encoding='utf-8') as f:
+                    f.write(text())
+                os.replace(temporary, path)
+    
     def list_file_types(self) -> None:
         """List all files and their detected categories"""
         print(f"File analysis for: {self.source_dir}")
         print("-" * 50)
         
-        files = [f for f in self.source_dir.iterdir() 
-                if f.is_file() and not self.should_skip_file(f)]
+        files = list(self.iter_sortable_files())
         
         if not files:
             print("No files found!")
@@ -212,11 +3243,11 @@ class FileSorter:
         
         # Group files by category
         categories = {}
-        for file_path in files:
-            category = self.get_file_category(file_path.suffix)
+        for entry in files:
+            category = self.classify(entry)
             if category not in categories:
                 categories[category] = []
-            categories[category].append(file_path.name)
+            categories[category].append(entry.name)
         
         # Print grouped results
         for category in sorted(categories.keys()):
@@ -228,6 +3259,99 @@ class FileSorter:
         print(f"Categories: {len(categories)}")
 
 
+def _sort_shard(source_dir: str, target_dir: str, unit: Tuple, dry_run: bool,
+                options: Dict, journal: Tuple = None, undo_path: str = None) -> Dict:
+    """Process-pool worker for FileSorter.sort_files_sharded
+    
+    Sorts one unit from _shard_units with a fresh FileSorter and returns its
+    stats for the parent to merge (with the worker's metrics under
+    'metrics' when they are enabled).
+    """
+    sorter = FileSorter(source_dir, target_dir, **options)
+    if journal is not None and not dry_run:
+        journal_path, done, pending = journal
+        sorter.resume_from(done, pending)
+        sorter.open_journal(journal_path)
+    if undo_path is not None and not dry_run:
+        sorter.open_undo_log(undo_path)
+    
+    if unit[0] == 'hash':
+        _, root, index, count = unit
+        prefix_len = len(root) + 1
+        entries = (entry for entry in sorter.iter_sortable_files(recursive=True)
+                   if zlib.crc32(entry.path[prefix_len:].encode('utf-8', 'surrogateescape')) % count == index)
+    else:
+        _, root, recursive = unit
+        entries = (entry for entry in scan_files(root, recursive, sorter.directory_pruner(), sorter.metrics)
+                   if not sorter.should_skip_file(entry))
+        if sorter.metrics is not None:
+            entries = sorter.metrics.timed('scan', entries)
+    
+    try:
+        for _ in sorter.move_files(sorter.classify_files(entries), dry_run):
+            pass
+    finally:
+        sorter.close_journal()
+        sorter.close_undo_log()
+    
+    if sorter.metrics is not None:
+        sorter.stats['metrics'] = sorter.metrics.to_dict()
+    return sorter.stats
+
+
+def _interrupt(signum, frame):
+    """SIGTERM handler: stop the way Ctrl+C does, so the logs are closed properly"""
+    raise KeyboardInterrupt
+
+
+def profile_call(function: Callable, stats_path: str, top: int = PROFILE_TOP) -> None:
+    """Run function under a profiler, save a .pstats file and print the hottest functions
+    
+    yappi is used when it is installed, since it profiles every thread (the
+    --workers movers included) and can save pstats data; otherwise cProfile,
+    which only sees the calling thread. Worker processes are not profiled.
+    The profile is saved even if function raises.
+    """
+    try:
+        import yappi
+    except ImportError:
+        yappi = None
+    
+    if yappi is not None:
+        yappi.set_clock_type('wall')
+        yappi.start()
+        try:
+            function()
+        finally:
+            yappi.stop()
+            yappi.get_func_stats().save(stats_path, type='pstat')
+            yappi.clear_stats()
+        profiler = 'yappi'
+    else:
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.runcall(function)
+        finally:
+            profile.dump_stats(stats_path)
+        profiler = 'cProfile'
+    
+    print(f"\nProfile ({profiler}) written to {stats_path}; top {top} functions by own time:")
+    stats = pstats.Stats(stats_path, stream=sys.stdout)
+    stats.strip_dirs().sort_stats('tottime').print_stats(top)
+
+
+def _argument_type(parse: Callable) -> Callable:
+    """Wrap a parse function for argparse so its ValueError message is shown"""
+    def convert(text):
+        try:
+            return parse(text)
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(str(e))
+    
+    return convert
+
+
 def main():
     """Command line interface"""
     parser = argparse.ArgumentParser(
@@ -238,6 +3362,24 @@ Examples:
   python file_sorter.py                    # Sort current directory
   python file_sorter.py --dry-run          # Preview what would be sorted
   python file_sorter.py --recursive        # Sort recursively
+  python file_sorter.py -r --stream        # Sort huge trees without listing them first
+  python file_sorter.py --workers 8        # Move files on 8 threads
+  python file_sorter.py -r --processes 32  # Sort a huge tree on 32 processes
+  python file_sorter.py -r --plan moves.jsonl    # Plan now...
+  python file_sorter.py --execute moves.jsonl    # ...move later
+  python file_sorter.py -r --journal run.log --resume   # Pick up an interrupted run
+  python file_sorter.py --undo .file_sorter_undo_20240101_120000.log   # Roll a run back
+  python file_sorter.py --watch -s ~/Downloads    # Sort new downloads as they finish
+  python file_sorter.py -r --index         # Re-runs skip directories that haven't changed
+  python file_sorter.py -r -x node_modules -x '.git'   # Never walk into these
+  python file_sorter.py --sniff            # Sort extensionless files by content
+  python file_sorter.py --dedup hardlink   # Store identical files only once
+  python file_sorter.py --layout date      # Images/2024/05/photo.jpg
+  python file_sorter.py --rule 'Cold:size>1G' --rule 'Old/Documents:ext=.pdf|.doc,age>1y'
+  python file_sorter.py --route 'Screenshots:Screenshot*' --skip '*.bak' --include .env
+  python file_sorter.py -r --stream --progress --log sort.log
+  python file_sorter.py -r --metrics-prom /var/lib/node_exporter/file_sorter.prom
+  python file_sorter.py -r --profile sort.pstats --profile-top 30
   python file_sorter.py --list             # List file types
   python file_sorter.py --source ~/Downloads --target ~/Organized
         """
@@ -262,23 +3404,254 @@ Examples:
                        action='store_true',
                        help='List files and their detected categories')
     
+    parser.add_argument('--stream',
+                       action='store_true',
+                       help='With --recursive, move files while scanning instead of listing them first')
+    
+    parser.add_argument('--count',
+                       action='store_true',
+                       help='With --stream, count the files in a separate pass before sorting')
+    
+    parser.add_argument('--workers', '-w',
+                       type=int, default=1,
+                       help='Number of threads moving files in parallel (default: 1)')
+    
+    parser.add_argument('--device-limit',
+                       type=int, default=DEFAULT_DEVICE_LIMIT,
+                       help=f'Max concurrent moves per disk when using --workers (default: {DEFAULT_DEVICE_LIMIT})')
+    
+    parser.add_argument('--processes', '-p',
+                       type=int, default=1,
+                       help='With --recursive, sort the tree in this many worker processes (default: 1)')
+    
+    parser.add_argument('--shard-by',
+                       choices=['top', 'hash'], default='top',
+                       help='How --processes splits the tree: by top-level subdirectory or by path hash (default: top)')
+    
+    parser.add_argument('--plan',
+                       metavar='FILE',
+                       help='Write the move plan to FILE (JSONL, gzip if it ends in .gz) instead of moving')
+    
+    parser.add_argument('--execute',
+                       metavar='FILE',
+                       help='Apply a plan written by --plan without rescanning')
+    
+    parser.add_argument('--journal',
+                       metavar='FILE',
+                       help='Record every move in a write-ahead journal FILE')
+    
+    parser.add_argument('--resume',
+                       action='store_true',
+                       help='With --journal, skip moves the journal shows as done and finish interrupted ones')
+    
+    parser.add_argument('--undo-log',
+                       metavar='FILE',
+                       help='Where to write the undo log (default: .file_sorter_undo_<time>.log in the target)')
+    
+    parser.add_argument('--no-undo-log',
+                       action='store_true',
+                       help="Don't write an undo log")
+    
+    parser.add_argument('--undo',
+                       metavar='LOG',
+                       help='Move the files recorded in an undo log back and remove emptied folders')
+    
+    parser.add_argument('--watch',
+                       action='store_true',
+                       help='Keep running and sort new files as they arrive (inotify on Linux, polling elsewhere)')
+    
+    parser.add_argument('--debounce',
+                       type=float, default=WATCH_DEBOUNCE,
+                       help=f'With --watch, seconds a file must be quiet before it is sorted (default: {WATCH_DEBOUNCE})')
+    
+    parser.add_argument('--poll',
+                       action='store_true',
+                       help='With --watch, poll the directory instead of using inotify')
+    
+    parser.add_argument('--index',
+                       nargs='?', const='', metavar='FILE',
+                       help=f'Keep a scan index (default: {INDEX_FILE_NAME} in the target) so re-runs skip unchanged directories')
+    
+    parser.add_argument('--exclude', '-x',
+                       action='append', default=[], metavar='GLOB',
+                       help='With --recursive, never descend into directories matching GLOB (name or relative path); repeatable')
+    
+    parser.add_argument('--sniff',
+                       action='store_true',
+                       help='Classify files with no or an ambiguous extension (.bin, .dat, ...) by their magic bytes')
+    
+    parser.add_argument('--dedup',
+                       choices=DEDUP_MODES,
+                       help='Find files whose content is already in the run or the target and skip them, '
+                            'hard-link them to the original, or quarantine them in Duplicates/')
+    
+    parser.add_argument('--layout',
+                       choices=SHARD_LAYOUTS,
+                       help='Shard each category folder by modification date (YYYY/MM), name prefix or name hash')
+    
+    parser.add_argument('--max-entries',
+                       type=int, default=SHARD_MAX_ENTRIES, metavar='N',
+                       help=f'With --layout, start a new shard folder once one holds N entries (default: {SHARD_MAX_ENTRIES})')
+    
+    parser.add_argument('--rule',
+                       action='append', default=[], type=_argument_type(parse_rule), metavar='CATEGORY:COND[,COND...]',
+                       help='Route matching files to CATEGORY before extension rules; conditions are '
+                            'ext=.a|.b, size>N, size<N, age>N, age<N, mtime>DATE, mtime<DATE; repeatable, first match wins')
+    
+    parser.add_argument('--skip',
+                       action='append', dest='name_patterns', default=[], metavar='PATTERN',
+                       type=lambda pattern: NamePattern('skip', pattern),
+                       help="Skip files whose name matches PATTERN (a glob, or a regex prefixed with 're:'); repeatable")
+    
+    parser.add_argument('--include',
+                       action='append', dest='name_patterns', metavar='PATTERN',
+                       type=lambda pattern: NamePattern('include', pattern),
+                       help='Sort files matching PATTERN even if a later pattern or a built-in rule (hidden, .tmp, ...) skips them')
+    
+    parser.add_argument('--route',
+                       action='append', dest='name_patterns', metavar='CATEGORY:PATTERN',
+                       type=_argument_type(parse_route),
+                       help='Sort files whose name matches PATTERN into CATEGORY; patterns apply in order, first match wins')
+    
+    parser.add_argument('--patterns',
+                       metavar='FILE',
+                       help="Read name patterns from FILE, one per line: 'skip PATTERN', 'include PATTERN' "
+                            "or 'route CATEGORY PATTERN'; they come before those given with --skip/--include/--route")
+    
+    parser.add_argument('--quiet', '-q',
+                       action='store_true',
+                       help='Print no per-file output and no summary')
+    
+    parser.add_argument('--progress',
+                       action='store_true',
+                       help='Show a single status line with counts, files/s and MB/s instead of a line per file')
+    
+    parser.add_argument('--log',
+                       metavar='FILE',
+                       help='Append the full per-file output to FILE (buffered); implies --progress')
+    
+    parser.add_argument('--metrics',
+                       action='store_true',
+                       help='Time each phase (scan, classify, mkdir, collision, move), count syscalls and show them in the summary')
+    
+    parser.add_argument('--metrics-json',
+                       metavar='FILE',
+                       help='Write the phase metrics to FILE as JSON; implies --metrics')
+    
+    parser.add_argument('--metrics-prom',
+                       metavar='FILE',
+                       help='Write the phase metrics to FILE in Prometheus text format (for the node exporter textfile collector); implies --metrics')
+    
+    parser.add_argument('--profile',
+                       metavar='FILE',
+                       help='Profile the run (with yappi if installed, else cProfile), save the stats to FILE (.pstats) and print the hottest functions')
+    
+    parser.add_argument('--profile-top',
+                       type=int, default=PROFILE_TOP, metavar='N',
+                       help=f'Number of functions in the --profile summary (default: {PROFILE_TOP})')
+    
     args = parser.parse_args()
     
+    if args.resume and not args.journal:
+        parser.error('--resume requires --journal')
+    if args.patterns:
+        try:
+            args.name_patterns = read_name_patterns(args.patterns) + args.name_patterns
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+    if args.watch and args.dry_run:
+        parser.error('--watch cannot be combined with --dry-run')
+    if args.dedup and (args.stream or args.processes > 1 or args.watch or args.plan or args.execute):
+        parser.error('--dedup needs the whole file list up front and cannot be combined with '
+                     '--stream, --processes, --watch, --plan or --execute')
+    
+    metrics = bool(args.metrics or args.metrics_json or args.metrics_prom)
+    
     # Create file sorter instance
-    sorter = FileSorter(args.source, args.target)
+    try:
+        sorter = FileSorter(args.source, args.target,
+                            workers=args.workers, device_limit=args.device_limit,
+                            exclude=args.exclude, sniff=args.sniff, dedup=args.dedup,
+                            layout=args.layout, max_entries=args.max_entries,
+                            rules=args.rule, name_patterns=args.name_patterns,
+                            quiet=args.quiet, metrics=metrics)
+    except ValueError as e:
+        parser.error(str(e))
     
+    # A service manager stopping --watch sends SIGTERM; without this the
+    # buffered undo records and journal entries would be lost
+    signal.signal(signal.SIGTERM, _interrupt)
+    
+    completed = False
     try:
-        if args.list:
-            sorter.list_file_types()
-        elif args.recursive:
-            sorter.sort_files_recursive(args.dry_run)
+        if args.execute:
+            header, plan = read_plan(args.execute)
+            sorter = FileSorter(header['source'], header['target'],
+                                workers=args.workers, device_limit=args.device_limit,
+                                exclude=args.exclude, sniff=args.sniff, dedup=args.dedup,
+                                layout=args.layout, max_entries=args.max_entries,
+                                rules=args.rule, name_patterns=args.name_patterns,
+                                quiet=args.quiet, metrics=metrics)
+        
+        if (args.progress or args.log) and not args.quiet:
+            sorter.set_reporter(ProgressReporter(log_path=args.log))
+        
+        moving = not (args.dry_run or args.list or args.plan or args.undo)
+        if args.journal and moving:
+            sorter.open_journal(args.journal, resume=args.resume)
+        sharded = args.recursive and args.processes > 1
+        if args.index is not None and moving and not (args.execute or args.watch or sharded):
+            sorter.open_index(args.index or None)
+        if moving and not args.no_undo_log:
+            sorter.open_undo_log(args.undo_log or sorter.default_undo_log_path())
+        
+        def run():
+            if args.undo:
+                sorter.undo(args.undo, args.dry_run)
+            elif args.watch:
+                sorter.watch(debounce=args.debounce, use_inotify=not args.poll)
+            elif args.execute:
+                sorter.execute_plan(plan, args.dry_run)
+            elif args.plan:
+                count = sorter.write_plan(sorter.iter_plan(args.recursive), args.plan)
+                print(f"Wrote a plan for {count} files to {args.plan}")
+            elif args.list:
+                sorter.list_file_types()
+            elif sharded:
+                sorter.sort_files_sharded(args.processes, args.shard_by, args.dry_run)
+            elif args.recursive:
+                sorter.sort_files_recursive(args.dry_run, stream=args.stream,
+                                            precount=args.count)
+            else:
+                sorter.sort_files(args.dry_run)
+        
+        if args.profile:
+            profile_call(run, args.profile, args.profile_top)
         else:
-            sorter.sort_files(args.dry_run)
+            run()
+        completed = True
             
     except KeyboardInterrupt:
+        sorter.reporter.flush()
         print("\n\nOperation cancelled by user.")
     except Exception as e:
+        sorter.reporter.flush()
         print(f"\nError: {e}")
+    finally:
+        if sorter.metrics is not None:
+            try:
+                sorter.write_metrics(args.metrics_json, args.metrics_prom)
+            except OSError as e:
+                print(f"Could not write metrics: {e}")
+        sorter.reporter.close()
+        sorter.close_journal()
+        sorter.close_index(completed)
+        if sorter.undo_log is not None:
+            undo_path = sorter.undo_log.path
+            sorter.close_undo_log()
+            # Not kept when the run moved nothing
+            if os.path.exists(undo_path) and not args.quiet:
+                print(f"Undo log: {undo_path}")
 
 
 if __name__ == "__main__":
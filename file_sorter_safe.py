@@ -25,14 +25,30 @@ except ImportError:
     HAS_SHUTIL = False
     print("Warning: shutil not available, using basic file operations")
 
+# os.scandir is only available on Python 3.5+
+HAS_SCANDIR = hasattr(os, 'scandir')
+
+# Kernel-side copy primitives (copy_file_range needs Python 3.8+ on Linux)
+HAS_COPY_FILE_RANGE = hasattr(os, 'copy_file_range')
+HAS_SENDFILE = hasattr(os, 'sendfile')
+
+# Chunk size for the streaming copy fallback (1 MiB)
+COPY_BUFFER_SIZE = 1024 * 1024
+
 class SafePath:
     """Fallback Path class when pathlib is not available"""
-    def __init__(self, path):
+    def __init__(self, path, entry=None):
         self.path = os.path.abspath(str(path))
         self.name = os.path.basename(self.path)
         self.suffix = os.path.splitext(self.path)[1]
         self.stem = os.path.splitext(self.name)[0]
-        self.parent = SafePath(os.path.dirname(self.path))
+        # DirEntry from os.scandir, used to answer type checks without a stat
+        self._entry = entry
+    
+    @property
+    def parent(self):
+        # Built on demand: creating it eagerly recursed up to the root
+        return SafePath(os.path.dirname(self.path))
     
     def __str__(self):
         return self.path
@@ -44,16 +60,31 @@ class SafePath:
         return os.path.exists(self.path)
     
     def is_file(self):
+        if self._entry is not None:
+            try:
+                return self._entry.is_file()
+            except OSError:
+                return False
         return os.path.isfile(self.path)
     
     def is_dir(self):
+        if self._entry is not None:
+            try:
+                return self._entry.is_dir()
+            except OSError:
+                return False
         return os.path.isdir(self.path)
     
     def iterdir(self):
         """List directory contents"""
-        if not self.is_dir():
-            return []
         try:
+            if HAS_SCANDIR:
+                # scandir returns the file type with each entry, so later
+                # is_file()/is_dir() calls don't need a stat per file
+                return [SafePath(entry.path, entry)
+                        for entry in os.scandir(self.path)]
+            if not self.is_dir():
+                return []
             return [SafePath(os.path.join(self.path, item)) 
                    for item in os.listdir(self.path)]
         except OSError:
@@ -75,7 +106,68 @@ class SafePath:
         """Return relative path"""
         return os.path.relpath(self.path, str(other))
 
-def safe_move(source, destination):
+def _kernel_copy(src_fd, dst_fd, offset, chunk_size, size):
+    """Copy src_fd to dst_fd from offset using copy_file_range or sendfile
+    
+    The data never passes through Python. Returns the offset reached. It is
+    short of size if neither primitive works for these files, or if one
+    reports end of file early, as some FUSE and network filesystems do;
+    the caller carries on from there another way.
+    """
+    if HAS_COPY_FILE_RANGE:
+        try:
+            while True:
+                copied = os.copy_file_range(src_fd, dst_fd, chunk_size, offset, offset)
+                if not copied:
+                    break
+                offset += copied
+        except OSError:
+            pass
+        if offset >= size:
+            return offset
+    
+    if HAS_SENDFILE:
+        try:
+            # sendfile writes at the current position of the destination
+            os.lseek(dst_fd, offset, os.SEEK_SET)
+            while True:
+                copied = os.sendfile(dst_fd, src_fd, offset, chunk_size)
+                if not copied:
+                    break
+                offset += copied
+        except OSError:
+            pass
+    
+    return offset
+
+def copy_file_streaming(source_path, dest_path, buffer_size=COPY_BUFFER_SIZE):
+    """Copy a file with memory use bounded by buffer_size
+    
+    Uses os.copy_file_range or os.sendfile when available, and a loop of
+    buffer_size chunks through a single reused buffer as the last resort
+    (also for whatever a kernel copy that stopped short left). Returns the
+    number of bytes written.
+    """
+    with open(source_path, 'rb') as src:
+        size = os.fstat(src.fileno()).st_size
+        with open(dest_path, 'wb') as dst:
+            offset = _kernel_copy(src.fileno(), dst.fileno(), 0, buffer_size, size)
+            if offset >= size:
+                return offset
+            
+            src.seek(offset)
+            dst.seek(offset)
+            buffer = bytearray(buffer_size)
+            view = memoryview(buffer)
+            while True:
+                count = src.readinto(buffer)
+                if not count:
+                    break
+                dst.write(view[:count])
+                offset += count
+    return offset
+
+def safe_move(source, destination, buffer_size=COPY_BUFFER_SIZE):
     """Safe file move with fallbacks"""
     source_path = str(source)
     dest_path = str(destination)
@@ -85,18 +177,30 @@ def safe_move(source, destination):
     else:
         # Fallback: copy then delete
         try:
-            # Simple copy for small files
-            with open(source_path, 'rb') as src:
-                with open(dest_path, 'wb') as dst:
-                    dst.write(src.read())
+            # Stream the copy so large files don't have to fit in memory
+            copied = copy_file_streaming(source_path, dest_path, buffer_size)
+            # Never delete the source unless the copy has all of it
+            size = os.stat(source_path).st_size
+            if copied != size:
+                raise OSError(f"copied {copied} of {size} bytes")
             os.remove(source_path)
         except Exception as e:
+            # Don't leave a partial copy behind
+            if os.path.exists(source_path) and os.path.exists(dest_path):
+                try:
+                    os.remove(dest_path)
+                except OSError:
+                    pass
             raise Exception(f"Could not move file: {e}")
 
 class FileSorter:
     """Main file sorting class with customizable rules and safety features"""
     
-    def __init__(self, source_dir: str = ".", target_dir: str = None):
+    def __init__(self, source_dir: str = ".", target_dir: str = None,
+                 buffer_size: int = COPY_BUFFER_SIZE):
+        # Chunk size used when a move has to fall back to copying
+        self.buffer_size = buffer_size
+        
         if HAS_PATHLIB:
             self.source_dir = Path(source_dir).resolve()
             self.target_dir = Path(target_dir).resolve() if target_dir else self.source_dir
@@ -183,7 +287,7 @@ class FileSorter:
                     destination = parent / new_name
                     counter += 1
             
-            safe_move(source, destination)
+            safe_move(source, destination, self.buffer_size)
             return True
             
         except Exception as e:
@@ -303,10 +407,14 @@ Examples:
                        action='store_true',
                        help='List files and their detected categories')
     
+    parser.add_argument('--buffer-size',
+                       type=int, default=COPY_BUFFER_SIZE // 1024,
+                       help=f'Copy buffer size in KiB when moves fall back to copying (default: {COPY_BUFFER_SIZE // 1024})')
+    
     args = parser.parse_args()
     
     # Create file sorter instance
-    sorter = FileSorter(args.source, args.target)
+    sorter = FileSorter(args.source, args.target, buffer_size=max(1, args.buffer_size) * 1024)
     
     try:
         if args.list:
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_files(tmp_path):
+    """Create files from {relative path: content} under tmp_path / 'src'"""
+    source = tmp_path / 'src'
+    source.mkdir()
+    
+    def make(files, root=source):
+        for name, content in files.items():
+            path = root / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(content.encode() if isinstance(content, str) else content)
+        return root
+    
+    return make
+
+
+@pytest.fixture
+def read_tree():
+    """Return {relative path: content} for every file below a directory"""
+    def read(root, include_hidden=False):
+        tree = {}
+        for folder, _, names in os.walk(str(root)):
+            for name in names:
+                if name.startswith('.') and not include_hidden:
+                    continue
+                path = os.path.join(folder, name)
+                with open(path, 'rb') as f:
+                    tree[os.path.relpath(path, str(root)).replace(os.sep, '/')] = f.read().decode()
+        return tree
+    
+    return read
@@ -0,0 +1,82 @@
+import os
+import shutil
+
+import pytest
+
+from file_sorter import FileSorter
+
+
+@pytest.fixture
+def cross_device(monkeypatch):
+    """Make every directory look like its own device, forcing the copy path"""
+    monkeypatch.setattr(FileSorter, '_device_of', lambda self, directory: hash(str(directory)))
+
+
+def test_cross_device_move_copies_data_and_times(make_files, read_tree, cross_device):
+    source = make_files({'a.txt': 'contents'})
+    os.utime(str(source / 'a.txt'), (1000000000, 1000000000))
+    sorter = FileSorter(str(source), quiet=True)
+    
+    sorter.sort_files()
+    
+    assert read_tree(source) == {'Documents/a.txt': 'contents'}
+    assert os.stat(str(source / 'Documents' / 'a.txt')).st_mtime == 1000000000
+    assert sorter.stats['strategies'] == {'copy': 1}
+    assert sorter.stats['bytes_copied'] == 8
+
+
+def test_cross_device_move_never_overwrites(make_files, read_tree, cross_device):
+    source = make_files({'a.txt': 'new'})
+    sorter = FileSorter(str(source), quiet=True)
+    destination = sorter.resolve_destination(source / 'Documents' / 'a.txt')
+    # Put there after the folder's names were seeded
+    make_files({'Documents/a.txt': 'hand placed'}, root=source)
+    
+    placed = sorter._transfer(source / 'a.txt', destination)
+    
+    assert placed == source / 'Documents' / 'a_1.txt'
+    assert read_tree(source) == {'Documents/a.txt': 'hand placed', 'Documents/a_1.txt': 'new'}
+
+
+def test_short_kernel_copy_falls_back_to_copyfile(make_files, read_tree, cross_device, monkeypatch):
+    source = make_files({'a.txt': 'x' * 1000})
+    # A filesystem that reports end of file straight away
+    monkeypatch.setattr(os, 'copy_file_range', lambda *args: 0, raising=False)
+    
+    FileSorter(str(source), quiet=True).sort_files()
+    
+    assert read_tree(source) == {'Documents/a.txt': 'x' * 1000}
+
+
+def test_incomplete_copy_keeps_the_source(make_files, read_tree, cross_device, monkeypatch):
+    source = make_files({'a.txt': 'x' * 1000})
+    monkeypatch.setattr(os, 'copy_file_range', lambda *args: 0, raising=False)
+    
+    def short_copy(source_path, destination_path):
+        with open(destination_path, 'wb') as f:
+            f.write(b'x' * 10)
+    
+    monkeypatch.setattr(shutil, 'copyfile', short_copy)
+    sorter = FileSorter(str(source), quiet=True)
+    sorter.sort_files()
+    
+    assert read_tree(source, include_hidden=True) == {'a.txt': 'x' * 1000}
+    assert sorter.stats['errors'] == 1
+
+
+def test_copy_is_written_under_a_hidden_name(make_files, read_tree, cross_device, monkeypatch):
+    source = make_files({'a.txt': 'contents'})
+    monkeypatch.setattr(os, 'copy_file_range', lambda *args: 0, raising=False)
+    real_copyfile = shutil.copyfile
+    seen = []
+    
+    def watched_copy(source_path, destination_path):
+        seen.append((os.path.basename(destination_path),
+                     os.path.exists(str(source / 'Documents' / 'a.txt'))))
+        return real_copyfile(source_path, destination_path)
+    
+    monkeypatch.setattr(shutil, 'copyfile', watched_copy)
+    FileSorter(str(source), quiet=True).sort_files()
+    
+    assert seen == [('.a.txt.file_sorter-partial', False)]
+    assert read_tree(source, include_hidden=True) == {'Documents/a.txt': 'contents'}
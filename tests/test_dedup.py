@@ -0,0 +1,148 @@
+import json
+import os
+
+import pytest
+
+from file_sorter import DEDUP_SAMPLE_SIZE, FileSorter, MoveJournal, ScanEntry, UndoLog, find_duplicates
+
+
+def entries(*paths):
+    return [ScanEntry.from_path(str(path)) for path in paths]
+
+
+def test_find_duplicates_reads_past_the_samples(make_files):
+    edge = b'x' * DEDUP_SAMPLE_SIZE
+    source = make_files({'a.bin': edge + b'middle 1' + edge, 'b.bin': edge + b'middle 2' + edge,
+                         'c.bin': edge + b'middle 1' + edge, 'empty1': '', 'empty2': ''})
+    
+    duplicates = find_duplicates(entries(*sorted(source.iterdir())))
+    
+    assert duplicates == {str(source / 'c.bin'): str(source / 'a.bin')}
+
+
+def test_skip_leaves_duplicates_in_place(make_files, read_tree):
+    source = make_files({'a.txt': 'same', 'b.txt': 'same', 'Documents/old.txt': 'older',
+                         'c.txt': 'older'})
+    sorter = FileSorter(str(source), quiet=True, dedup='skip')
+    
+    sorter.sort_files()
+    
+    assert read_tree(source) == {'Documents/a.txt': 'same', 'Documents/old.txt': 'older',
+                                 'b.txt': 'same', 'c.txt': 'older'}
+    assert sorter.stats['duplicates'] == 2
+
+
+def test_quarantine_moves_duplicates_aside_and_undo_restores_them(make_files, read_tree, tmp_path):
+    source = make_files({'a.jpg': 'same', 'b.jpg': 'same'})
+    log = tmp_path / 'undo.log'
+    sorter = FileSorter(str(source), quiet=True, dedup='quarantine')
+    sorter.open_undo_log(str(log))
+    
+    sorter.sort_files()
+    sorter.close_undo_log()
+    
+    assert read_tree(source) == {'Images/a.jpg': 'same', 'Duplicates/b.jpg': 'same'}
+    FileSorter(str(source), quiet=True).undo(str(log))
+    assert read_tree(source) == {'a.jpg': 'same', 'b.jpg': 'same'}
+
+
+@pytest.mark.skipif(not hasattr(os, 'link'), reason='needs hard links')
+def test_hardlink_links_duplicates_to_the_moved_original(make_files, read_tree):
+    source = make_files({'a.jpg': 'same', 'b.jpg': 'same', 'c.jpg': 'other'})
+    sorter = FileSorter(str(source), quiet=True, dedup='hardlink')
+    
+    sorter.sort_files()
+    
+    assert read_tree(source) == {'Images/a.jpg': 'same', 'Images/b.jpg': 'same',
+                                 'Images/c.jpg': 'other'}
+    assert os.path.samefile(str(source / 'Images' / 'a.jpg'), str(source / 'Images' / 'b.jpg'))
+    assert sorter.stats['strategies']['hardlink'] == 1
+
+
+@pytest.mark.skipif(not hasattr(os, 'link'), reason='needs hard links')
+def test_hardlink_to_existing_file_keeps_a_taken_name(make_files, read_tree):
+    source = make_files({'photo.jpg': 'same', 'Images/photo.jpg': 'same'})
+    
+    FileSorter(str(source), quiet=True, dedup='hardlink').sort_files()
+    
+    assert read_tree(source) == {'Images/photo.jpg': 'same', 'Images/photo_1.jpg': 'same'}
+    assert os.path.samefile(str(source / 'Images' / 'photo.jpg'),
+                            str(source / 'Images' / 'photo_1.jpg'))
+
+
+def test_hardlink_falls_back_to_a_move_when_linking_fails(make_files, read_tree, monkeypatch):
+    source = make_files({'a.jpg': 'same', 'b.jpg': 'same'})
+    
+    def no_links(*args, **kwargs):
+        raise PermissionError(1, 'Operation not permitted')
+    
+    monkeypatch.setattr(os, 'link', no_links)
+    FileSorter(str(source), quiet=True, dedup='hardlink').sort_files()
+    
+    assert read_tree(source) == {'Images/a.jpg': 'same', 'Images/b.jpg': 'same'}
+    assert not os.path.samefile(str(source / 'Images' / 'a.jpg'), str(source / 'Images' / 'b.jpg'))
+
+
+@pytest.mark.skipif(not hasattr(os, 'link'), reason='needs hard links')
+def test_undo_restores_hard_linked_duplicates_as_copies(make_files, read_tree, tmp_path):
+    source = make_files({'a.jpg': 'same', 'b.jpg': 'same'})
+    log = tmp_path / 'undo.log'
+    sorter = FileSorter(str(source), quiet=True, dedup='hardlink')
+    sorter.open_undo_log(str(log))
+    sorter.sort_files()
+    sorter.close_undo_log()
+    assert UndoLog.read(str(log))[2] == {str(source / 'Images' / 'b.jpg')}
+    
+    FileSorter(str(source), quiet=True).undo(str(log))
+    
+    assert read_tree(source) == {'a.jpg': 'same', 'b.jpg': 'same'}
+    assert not os.path.samefile(str(source / 'a.jpg'), str(source / 'b.jpg'))
+
+
+@pytest.mark.skipif(not hasattr(os, 'link'), reason='needs hard links')
+def test_duplicate_that_cannot_be_removed_stays_put(make_files, read_tree, monkeypatch):
+    source = make_files({'a.jpg': 'same', 'b.jpg': 'same', 'c.jpg': 'same'})
+    real_unlink = os.unlink
+    
+    def unlink(path, *args, **kwargs):
+        if path == str(source / 'b.jpg'):
+            raise PermissionError(1, 'Operation not permitted', path)
+        return real_unlink(path, *args, **kwargs)
+    
+    monkeypatch.setattr(os, 'unlink', unlink)
+    sorter = FileSorter(str(source), quiet=True, dedup='hardlink')
+    results = {os.path.basename(result.source): result.status for result in sorter.iter_results()}
+    
+    assert read_tree(source) == {'Images/a.jpg': 'same', 'b.jpg': 'same', 'Images/c.jpg': 'same'}
+    assert results['b.jpg'] == 'failed' and results['c.jpg'] == 'linked'
+    assert sorter.stats['errors'] == 1
+
+
+@pytest.mark.skipif(not hasattr(os, 'link'), reason='needs hard links')
+def test_resume_after_crash_between_link_and_unlink(make_files, read_tree, tmp_path):
+    source = make_files({'Images/a.jpg': 'same', 'b.jpg': 'same'})
+    original = str(source / 'Images' / 'a.jpg')
+    link = str(source / 'Images' / 'b.jpg')
+    os.link(original, link)
+    journal = tmp_path / 'run.journal'
+    with open(str(journal), 'w') as f:
+        f.write(json.dumps(['i', str(source / 'b.jpg'), link, original]) + '\n')
+    
+    sorter = FileSorter(str(source), quiet=True, dedup='hardlink')
+    sorter.open_journal(str(journal), resume=True)
+    sorter.sort_files()
+    sorter.close_journal()
+    
+    assert read_tree(source) == {'Images/a.jpg': 'same', 'Images/b.jpg': 'same'}
+    assert os.path.samefile(original, link)
+    done, pending, links = MoveJournal.replay(str(journal))
+    assert done == {str(source / 'b.jpg'): link} and not pending
+
+
+def test_dry_run_changes_nothing(make_files, read_tree):
+    files = {'a.jpg': 'same', 'b.jpg': 'same'}
+    source = make_files(files)
+    
+    FileSorter(str(source), quiet=True, dedup='hardlink').sort_files(dry_run=True)
+    
+    assert read_tree(source) == files
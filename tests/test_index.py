@@ -0,0 +1,75 @@
+import sys
+
+import file_sorter
+from file_sorter import FileSorter, NamePattern
+
+
+def run_indexed(source, index):
+    sorter = FileSorter(str(source), quiet=True)
+    sorter.open_index(str(index))
+    sorter.sort_files_recursive()
+    sorter.close_index()
+    return sorter
+
+
+def test_rerun_skips_unchanged_directories_and_sorts_new_files(make_files, read_tree, tmp_path):
+    source = make_files({'s1/a.pdf': 'a', 's2/b.jpg': 'b'})
+    index = tmp_path / 'index.sqlite'
+    run_indexed(source, index)
+    run_indexed(source, index)
+    
+    (source / 's2' / 'c.pdf').write_text('c')
+    sorter = run_indexed(source, index)
+    
+    assert sorter.stats['dirs_unchanged'] >= 1
+    assert read_tree(source) == {'Documents/a.pdf': 'a', 'Documents/c.pdf': 'c', 'Images/b.jpg': 'b'}
+
+
+def test_interrupted_run_does_not_mark_unvisited_directories(make_files, read_tree, tmp_path,
+                                                            monkeypatch):
+    source = make_files({'s1/a.pdf': 'a', 's2/b.pdf': 'b', 's2/c.pdf': 'c'})
+    index = tmp_path / 'index.sqlite'
+    real_place = FileSorter._place
+    
+    def interrupted(self, *args):
+        if (source / 'Documents').exists() and any((source / 'Documents').iterdir()):
+            raise KeyboardInterrupt
+        return real_place(self, *args)
+    
+    monkeypatch.setattr(FileSorter, '_place', interrupted)
+    monkeypatch.setattr(sys, 'argv', ['file_sorter.py', '-s', str(source), '-r', '-q',
+                                      '--no-undo-log', '--index', str(index)])
+    file_sorter.main()
+    assert len(read_tree(source / 'Documents')) == 1
+    
+    monkeypatch.setattr(FileSorter, '_place', real_place)
+    file_sorter.main()
+    
+    assert read_tree(source) == {'Documents/a.pdf': 'a', 'Documents/b.pdf': 'b',
+                                 'Documents/c.pdf': 'c'}
+
+
+def test_sharded_runs_do_not_create_an_index(make_files, tmp_path, monkeypatch):
+    source = make_files({'s1/a.pdf': 'a'})
+    index = tmp_path / 'index.sqlite'
+    monkeypatch.setattr(sys, 'argv', ['file_sorter.py', '-s', str(source), '-r', '-q',
+                                      '--processes', '2', '--index', str(index)])
+    file_sorter.main()
+    
+    assert not index.exists()
+
+
+def test_changed_configuration_lists_directories_again(make_files, read_tree, tmp_path):
+    source = make_files({'keep/a.log': 'log', 'keep/b.pdf': 'b'})
+    index = tmp_path / 'index.sqlite'
+    run_indexed(source, index)
+    assert read_tree(source) == {'keep/a.log': 'log', 'Documents/b.pdf': 'b'}
+    
+    sorter = FileSorter(str(source), quiet=True, name_patterns=[NamePattern('include', '*.log')])
+    sorter.open_index(str(index))
+    sorter.sort_files_recursive()
+    sorter.close_index()
+    
+    assert sorter.stats['dirs_unchanged'] == 0
+    assert read_tree(source) == {'LOG/a.log': 'log', 'Documents/b.pdf': 'b'}
+    assert run_indexed(source, index).stats['dirs_unchanged'] == 0
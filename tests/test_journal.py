@@ -0,0 +1,179 @@
+import json
+import os
+
+import pytest
+
+from file_sorter import FileSorter, MoveJournal
+
+
+def write_journal(path, *records):
+    with open(str(path), 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def test_replay_pairs_intents_with_outcomes(tmp_path):
+    journal = tmp_path / 'run.journal'
+    write_journal(journal,
+                  ['i', '/s/a', '/t/a'], ['d', '/s/a'],
+                  ['i', '/s/b', '/t/b'], ['f', '/s/b'],
+                  ['i', '/s/c', '/t/c'])
+    with open(str(journal), 'a') as f:
+        f.write('["d", "/s/c"')   # torn by a crash
+    
+    done, pending, links = MoveJournal.replay(str(journal))
+    
+    assert done == {'/s/a': '/t/a'}
+    assert pending == {'/s/c': '/t/c'}
+
+
+def test_resume_after_interrupted_move(make_files, read_tree, tmp_path, monkeypatch):
+    source = make_files({f'f{n}.txt': f'data {n}' for n in range(5)})
+    journal = str(tmp_path / 'run.journal')
+    real_place = FileSorter._place
+    calls = []
+    
+    def interrupted(self, *args):
+        calls.append(args)
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return real_place(self, *args)
+    
+    monkeypatch.setattr(FileSorter, '_place', interrupted)
+    sorter = FileSorter(str(source), quiet=True)
+    sorter.open_journal(journal)
+    with pytest.raises(KeyboardInterrupt):
+        sorter.sort_files()
+    sorter.close_journal()
+    monkeypatch.setattr(FileSorter, '_place', real_place)
+    
+    done, pending, links = MoveJournal.replay(journal)
+    assert len(done) == 2 and len(pending) == 1
+    
+    sorter = FileSorter(str(source), quiet=True)
+    sorter.open_journal(journal, resume=True)
+    sorter.sort_files()
+    sorter.close_journal()
+    
+    assert read_tree(source) == {f'Documents/f{n}.txt': f'data {n}' for n in range(5)}
+    assert sorter.stats['errors'] == 0
+
+
+def test_resume_removes_partial_copy_and_keeps_the_name(make_files, read_tree, tmp_path):
+    source = make_files({'report.txt': 'full contents', 'Documents/notes.txt': 'other'})
+    destination = source / 'Documents' / 'report.txt'
+    # A cross-device copy cut short, still under its hidden name
+    (source / 'Documents' / '.report.txt.file_sorter-partial').write_text('full')
+    journal = tmp_path / 'run.journal'
+    write_journal(journal, ['i', str(source / 'report.txt'), str(destination)])
+    
+    sorter = FileSorter(str(source), quiet=True)
+    sorter.open_journal(str(journal), resume=True)
+    sorter.sort_files()
+    sorter.close_journal()
+    
+    assert read_tree(source, include_hidden=True) == {'Documents/report.txt': 'full contents',
+                                                      'Documents/notes.txt': 'other'}
+
+
+def test_resume_keeps_an_unrelated_file_at_the_destination(make_files, read_tree, tmp_path):
+    source = make_files({'report.txt': 'mine', 'Documents/report.txt': 'someone else'})
+    journal = tmp_path / 'run.journal'
+    write_journal(journal, ['i', str(source / 'report.txt'), str(source / 'Documents' / 'report.txt')])
+    
+    sorter = FileSorter(str(source), quiet=True)
+    sorter.open_journal(str(journal), resume=True)
+    sorter.sort_files()
+    sorter.close_journal()
+    
+    assert read_tree(source) == {'Documents/report.txt': 'someone else',
+                                 'Documents/report_1.txt': 'mine'}
+
+
+def test_resume_never_removes_a_finished_move(make_files, read_tree, tmp_path):
+    # one/a.txt finished its move to a.txt; two/a.txt's intent for the
+    # same name was superseded (e.g. by a competing worker) and never ran
+    source = make_files({'one/a.txt': 'from A', 'two/a.txt': 'from B'})
+    (source / 'Documents').mkdir()
+    os.rename(str(source / 'one' / 'a.txt'), str(source / 'Documents' / 'a.txt'))
+    destination = str(source / 'Documents' / 'a.txt')
+    journal = tmp_path / 'run.journal'
+    write_journal(journal,
+                  ['i', str(source / 'one' / 'a.txt'), destination],
+                  ['i', str(source / 'two' / 'a.txt'), destination],
+                  ['d', str(source / 'one' / 'a.txt')])
+    
+    sorter = FileSorter(str(source), quiet=True)
+    sorter.open_journal(str(journal), resume=True)
+    sorter.sort_files_recursive()
+    sorter.close_journal()
+    
+    assert read_tree(source) == {'Documents/a.txt': 'from A', 'Documents/a_1.txt': 'from B'}
+
+
+def test_resume_after_crash_between_link_and_unlink(make_files, read_tree, tmp_path):
+    source = make_files({'a.txt': 'a'})
+    (source / 'Documents').mkdir()
+    os.link(str(source / 'a.txt'), str(source / 'Documents' / 'a.txt'))
+    journal = tmp_path / 'run.journal'
+    write_journal(journal, ['i', str(source / 'a.txt'), str(source / 'Documents' / 'a.txt')])
+    
+    sorter = FileSorter(str(source), quiet=True)
+    sorter.open_journal(str(journal), resume=True)
+    sorter.sort_files()
+    sorter.close_journal()
+    
+    assert read_tree(source) == {'Documents/a.txt': 'a'}
+
+
+def test_resume_counts_finished_moves_and_skips_done_sources(make_files, tmp_path):
+    source = make_files({'kept.txt': 'still here', 'moved.txt': 'x'})
+    (source / 'Documents').mkdir()
+    (source / 'Documents' / 'gone.txt').write_text('g')
+    journal = tmp_path / 'run.journal'
+    write_journal(journal,
+                  ['i', str(source / 'kept.txt'), str(source / 'Documents' / 'kept.txt')],
+                  ['d', str(source / 'kept.txt')],
+                  ['i', str(source / 'gone.txt'), str(source / 'Documents' / 'gone.txt')])
+    
+    sorter = FileSorter(str(source), quiet=True)
+    sorter.open_journal(str(journal), resume=True)
+    results = list(sorter.iter_results())
+    sorter.close_journal()
+    
+    assert [os.path.basename(result.source) for result in results] == ['moved.txt']
+    assert sorter.stats['resumed'] == 1
+    assert (source / 'kept.txt').exists()
+    assert (source / 'Documents' / 'gone.txt').exists()
+
+
+def test_journal_records_every_move(make_files, tmp_path):
+    source = make_files({'a.jpg': 'a', 'b.pdf': 'b'})
+    journal = str(tmp_path / 'run.journal')
+    
+    sorter = FileSorter(str(source), quiet=True)
+    sorter.open_journal(journal)
+    sorter.sort_files()
+    sorter.close_journal()
+    
+    done, pending, links = MoveJournal.replay(journal)
+    assert done == {str(source / 'a.jpg'): str(source / 'Images' / 'a.jpg'),
+                    str(source / 'b.pdf'): str(source / 'Documents' / 'b.pdf')}
+    assert not pending
+
+
+def test_sharded_resume_hands_the_replay_to_the_workers(make_files, read_tree, tmp_path):
+    source = make_files({'d0/kept.txt': 'kept', 'd1/new.txt': 'new'})
+    journal = tmp_path / 'run.journal'
+    write_journal(journal,
+                  ['i', str(source / 'd0' / 'kept.txt'), str(source / 'Documents' / 'kept.txt')],
+                  ['d', str(source / 'd0' / 'kept.txt')])
+    
+    sorter = FileSorter(str(source), quiet=True)
+    sorter.open_journal(str(journal), resume=True)
+    sorter.sort_files_sharded(2)
+    
+    assert read_tree(source) == {'d0/kept.txt': 'kept', 'Documents/new.txt': 'new'}
+    assert sorter.stats['resumed'] == 1
+    done, pending, links = MoveJournal.replay(str(journal))
+    assert str(source / 'd1' / 'new.txt') in done and not pending
@@ -0,0 +1,45 @@
+import os
+
+from file_sorter import FileSorter, PhaseMetrics, copy_file_fast, parse_rule
+
+
+def test_stat_counts_are_kept_per_sorter(make_files):
+    source = make_files({'a.txt': 'a', 'b.txt': 'b', 'c.txt': 'c'})
+    rules = [parse_rule('Big:size>1M')]
+    first = FileSorter(str(source), quiet=True, rules=rules, metrics=True)
+    second = FileSorter(str(source), quiet=True, rules=rules, metrics=True)
+    
+    list(first.classify_files(first.iter_sortable_files()))
+    
+    assert first.metrics.snapshot_syscalls()['stat'] == 3
+    assert 'stat' not in second.metrics.snapshot_syscalls()
+
+
+def test_merge_adds_another_sorters_counts():
+    metrics = PhaseMetrics()
+    metrics.syscall('stat', 2)
+    other = PhaseMetrics()
+    other.syscall('stat', 3)
+    other.add('move', 1.5)
+    
+    metrics.merge(other.to_dict())
+    
+    assert metrics.snapshot_syscalls() == {'stat': 5}
+    assert metrics.seconds['move'] == 1.5
+
+
+def test_copy_counts_the_primitive_that_ran(tmp_path, monkeypatch):
+    source = tmp_path / 'source'
+    source.write_bytes(b'data' * 100)
+    metrics = PhaseMetrics()
+    # A filesystem that reports end of file straight away
+    monkeypatch.setattr(os, 'copy_file_range', lambda *args: 0, raising=False)
+    
+    assert copy_file_fast(str(source), str(tmp_path / 'copy'), metrics) == 400
+    
+    assert metrics.snapshot_syscalls() == {'copy_file_range': 1, 'copyfile': 1}
+    
+    monkeypatch.delattr(os, 'copy_file_range')
+    metrics = PhaseMetrics()
+    copy_file_fast(str(source), str(tmp_path / 'copy'), metrics)
+    assert metrics.snapshot_syscalls() == {'copyfile': 1}
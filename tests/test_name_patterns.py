@@ -0,0 +1,81 @@
+import sys
+
+import pytest
+
+import file_sorter
+from file_sorter import FileSorter, NameMatcher, NamePattern, parse_route, read_name_patterns
+
+
+def first_match(patterns, name):
+    pattern = NameMatcher(patterns).match(name)
+    return pattern and pattern.pattern
+
+
+def test_first_matching_pattern_wins():
+    patterns = [NamePattern('include', 'keep.*'), NamePattern('skip', '*.bak'),
+                NamePattern('route', 're:IMG_\\d+\\.jpg', 'Camera')]
+    
+    assert first_match(patterns, 'keep.bak') == 'keep.*'
+    assert first_match(patterns, 'old.bak') == '*.bak'
+    assert first_match(patterns, 'IMG_0001.jpg') == 're:IMG_\\d+\\.jpg'
+    assert first_match(patterns, 'IMG_0001.jpg.txt') is None
+
+
+def test_leading_flags_apply_to_their_own_pattern_only():
+    patterns = [NamePattern('skip', 're:(?i).*\\.bak'), NamePattern('skip', 're:X.*')]
+    
+    assert first_match(patterns, 'OLD.BAK') == 're:(?i).*\\.bak'
+    assert first_match(patterns, 'x1') is None
+    assert first_match(patterns, 'X1') == 're:X.*'
+
+
+def test_groups_and_backreferences_keep_their_meaning():
+    patterns = [NamePattern('skip', 're:(a)\\1'), NamePattern('skip', 're:(?P<n>b)(?P=n)'),
+                NamePattern('skip', 're:(?P<n>c)(?P=n)'), NamePattern('skip', 're:(?x) d  e'),
+                NamePattern('skip', '*x*y*')]
+    
+    assert first_match(patterns, 'aa') == 're:(a)\\1'
+    assert first_match(patterns, 'bb') == 're:(?P<n>b)(?P=n)'
+    assert first_match(patterns, 'cc') == 're:(?P<n>c)(?P=n)'
+    assert first_match(patterns, 'de') == 're:(?x) d  e'
+    assert first_match(patterns, '1x2y3') == '*x*y*'
+    assert first_match(patterns, 'ab') is None
+
+
+def test_bad_regular_expression_raises_value_error():
+    with pytest.raises(ValueError, match='Bad regular expression'):
+        NameMatcher([NamePattern('skip', 're:(unclosed')])
+
+
+def test_bad_regular_expression_is_reported_by_the_command_line(monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ['file_sorter.py', '--skip', 're:[a-'])
+    
+    with pytest.raises(SystemExit):
+        file_sorter.main()
+    
+    assert 'Bad regular expression' in capsys.readouterr().err
+
+
+def test_read_name_patterns(tmp_path):
+    path = tmp_path / 'patterns'
+    path.write_text('# comment\n\nskip *.tmp\ninclude .keep\nroute Work/Reports report_*\n')
+    
+    assert read_name_patterns(str(path)) == [NamePattern('skip', '*.tmp'),
+                                             NamePattern('include', '.keep'),
+                                             NamePattern('route', 'report_*', 'Work/Reports')]
+    path.write_text('ignore *.tmp\n')
+    with pytest.raises(ValueError):
+        read_name_patterns(str(path))
+
+
+def test_patterns_skip_include_and_route_files(make_files, read_tree):
+    source = make_files({'a.bak': 'a', 'report_1.pdf': 'r', '.keep': 'k', '.hidden': 'h',
+                         'b.pdf': 'b'})
+    patterns = [NamePattern('skip', 're:(?i).*\\.BAK'), NamePattern('include', '.keep'),
+                parse_route('Work/Reports:report_*')]
+    
+    FileSorter(str(source), quiet=True, name_patterns=patterns).sort_files()
+    
+    assert read_tree(source, include_hidden=True) == {
+        'a.bak': 'a', '.hidden': 'h', 'Work/Reports/report_1.pdf': 'r',
+        'Documents/b.pdf': 'b', 'NO_EXTENSION/.keep': 'k'}
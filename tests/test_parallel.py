@@ -0,0 +1,68 @@
+import os
+import threading
+import time
+
+import pytest
+
+from file_sorter import FileSorter
+
+
+def sorted_names(source, workers):
+    sorter = FileSorter(str(source), quiet=True, workers=workers)
+    return {os.path.relpath(result.source, str(source)): os.path.relpath(result.destination, str(source))
+            for result in sorter.iter_results(recursive=True)}
+
+
+def test_collision_names_match_a_sequential_run(make_files, tmp_path):
+    files = {f'd{n:02d}/report.txt': str(n) for n in range(20)}
+    files.update({f'd{n:02d}/photo.jpg': str(n) for n in range(20)})
+    sequential = sorted_names(make_files(files, root=tmp_path / 'one'), workers=1)
+    
+    parallel = sorted_names(make_files(files, root=tmp_path / 'four'), workers=4)
+    
+    assert parallel == sequential
+    assert len(set(parallel.values())) == 40
+
+
+def test_moves_per_device_stay_within_the_limit(make_files, read_tree, monkeypatch):
+    source = make_files({f'f{n}.txt': str(n) for n in range(12)})
+    running = []
+    peak = []
+    lock = threading.Lock()
+    real_transfer = FileSorter._transfer
+    
+    def slow_transfer(self, *args, **kwargs):
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.02)
+        try:
+            return real_transfer(self, *args, **kwargs)
+        finally:
+            with lock:
+                running.pop()
+    
+    monkeypatch.setattr(FileSorter, '_transfer', slow_transfer)
+    sorter = FileSorter(str(source), quiet=True, workers=8, device_limit=2)
+    sorter.sort_files()
+    
+    assert max(peak) == 2
+    assert read_tree(source) == {f'Documents/f{n}.txt': str(n) for n in range(12)}
+
+
+@pytest.mark.parametrize('shard_by', ['top', 'hash'])
+def test_sharded_run_sorts_everything_and_merges_stats(make_files, read_tree, shard_by):
+    files = {f'd{n}/same.txt': f'text {n}' for n in range(4)}
+    files.update({f'd{n}/deep/p{n}.jpg': f'jpg {n}' for n in range(4)})
+    files['top.pdf'] = 'pdf'
+    source = make_files(files)
+    sorter = FileSorter(str(source), quiet=True, metrics=True)
+    
+    sorter.sort_files_sharded(2, shard_by)
+    
+    tree = read_tree(source)
+    assert sorted(tree.values()) == sorted(files.values())
+    assert all(path.split('/')[0] in ('Documents', 'Images') for path in tree)
+    assert sorter.stats['moved'] == 9 and sorter.stats['errors'] == 0
+    assert sorter.stats['categories_created'] == {'Documents', 'Images'}
+    assert sorter.metrics.calls['move'] == 9
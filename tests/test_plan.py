@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from file_sorter import FileSorter, read_plan
+
+
+@pytest.mark.parametrize('name', ['moves.jsonl', 'moves.jsonl.gz'])
+def test_written_plan_reads_back_the_same(make_files, tmp_path, name):
+    source = make_files({'a.txt': 'aaa', 'b.jpg': 'b', 'sub/c.pdf': 'cc'})
+    sorter = FileSorter(str(source), quiet=True)
+    plan = sorter.plan(recursive=True)
+    path = str(tmp_path / name)
+    
+    assert sorter.write_plan(plan, path) == 3
+    header, ops = read_plan(path)
+    
+    assert header['source'] == header['target'] == str(source)
+    assert list(ops) == plan
+    assert sorted(op.size for op in plan) == [1, 2, 3]
+
+
+def test_file_gone_before_planning_is_reported_and_left_out(make_files, monkeypatch):
+    source = make_files({'a.txt': 'a', 'gone.txt': 'g'})
+    sorter = FileSorter(str(source), quiet=True)
+    real_classify = sorter.classify
+    
+    def classify_and_delete(entry):
+        if entry.name == 'gone.txt':
+            (source / 'gone.txt').unlink()
+        return real_classify(entry)
+    
+    monkeypatch.setattr(sorter, 'classify', classify_and_delete)
+    plan = sorter.plan()
+    
+    assert [op.destination for op in plan] == [str(source / 'Documents' / 'a.txt')]
+    assert sorter.stats['errors'] == 1
+
+
+def test_execute_resolves_names_taken_since_planning(make_files, read_tree, tmp_path):
+    source = make_files({'a.txt': 'planned', 'b.txt': 'gone'})
+    path = str(tmp_path / 'moves.jsonl')
+    planner = FileSorter(str(source), quiet=True)
+    planner.write_plan(planner.iter_plan(), path)
+    make_files({'Documents/a.txt': 'arrived later'}, root=source)
+    (source / 'b.txt').unlink()
+    
+    header, ops = read_plan(path)
+    sorter = FileSorter(header['source'], header['target'], quiet=True)
+    results = list(sorter.execute(ops))
+    
+    assert read_tree(source) == {'Documents/a.txt': 'arrived later', 'Documents/a_1.txt': 'planned'}
+    assert {result.source: result.status for result in results} == {
+        str(source / 'a.txt'): 'moved', str(source / 'b.txt'): 'failed'}
+
+
+def test_plan_with_another_version_is_rejected(tmp_path):
+    path = tmp_path / 'moves.jsonl'
+    path.write_text(json.dumps({'version': 99, 'source': '/s', 'target': '/t'}) + '\n')
+    
+    with pytest.raises(ValueError, match='Unsupported plan version'):
+        read_plan(str(path))
@@ -0,0 +1,39 @@
+import io
+import time
+
+from file_sorter import FileSorter, MoveResult, ProgressReporter, Reporter
+
+
+class Recorder(Reporter):
+    needs_sizes = True
+    
+    def __init__(self):
+        self.results = []
+    
+    def result(self, record):
+        self.results.append(record)
+
+
+def test_progress_line_is_redrawn_between_results():
+    stream = io.StringIO()
+    reporter = ProgressReporter(stream, interval=0.01)
+    reporter.result(MoveResult('/s/a', '/t/a', 'Documents', 'moved', 3 * 1024 * 1024))
+    time.sleep(0.1)
+    reporter.close()
+    
+    lines = stream.getvalue().splitlines()
+    assert len(lines) > 2
+    assert lines[-1].startswith('1 files | 1 moved')
+    assert reporter.bytes == 3 * 1024 * 1024
+
+
+def test_results_carry_sizes_only_when_the_reporter_wants_them(make_files):
+    source = make_files({'a.txt': 'four', 'b.jpg': 'seven!!'})
+    sorter = FileSorter(str(source), quiet=True)
+    sorter.set_reporter(Recorder())
+    
+    sorter.sort_files()
+    
+    assert sorted(record.size for record in sorter.reporter.results) == [4, 7]
+    make_files({'c.txt': 'c'}, root=source)
+    assert [record.size for record in FileSorter(str(source), quiet=True).iter_results()] == [None]
@@ -0,0 +1,52 @@
+import os
+import sys
+import time
+from datetime import datetime
+
+import pytest
+
+import file_sorter
+from file_sorter import FileSorter, Rule, parse_rule
+
+
+def test_parse_rule_fills_only_the_given_conditions():
+    rule = parse_rule('Old/Documents:ext=pdf|.DOC,size>1.5K,age>2w')
+    
+    assert rule == Rule('Old/Documents', extensions=frozenset({'.pdf', '.doc'}),
+                        min_size=1536, min_age=14 * 86400)
+    assert Rule('Cold').before is None
+
+
+def test_parse_rule_dates():
+    assert parse_rule('A:mtime>2024-01-02').after == datetime(2024, 1, 2).timestamp()
+    assert parse_rule('A:mtime<2024-01-02T03:04').before == datetime(2024, 1, 2, 3, 4).timestamp()
+    with pytest.raises(ValueError, match='Bad date'):
+        parse_rule('A:mtime<yesterday')
+
+
+@pytest.mark.parametrize('text', ['Cold', ':size>1G', 'A:size=1G', 'A:ext>.iso', 'A:size>big',
+                                  'A:color=red'])
+def test_parse_rule_rejects_bad_rules(text):
+    with pytest.raises(ValueError):
+        parse_rule(text)
+
+
+def test_bad_rule_is_reported_by_the_command_line(monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ['file_sorter.py', '--rule', 'Cold:size>big'])
+    
+    with pytest.raises(SystemExit):
+        file_sorter.main()
+    
+    assert "Bad size: 'big'" in capsys.readouterr().err
+
+
+def test_rules_route_before_extensions(make_files, read_tree):
+    source = make_files({'big.zip': b'x' * 2048, 'small.zip': 'x', 'old.txt': 'o', 'new.txt': 'n'})
+    old = time.time() - 3 * 86400
+    os.utime(str(source / 'old.txt'), (old, old))
+    rules = [parse_rule('Cold:size>1K'), parse_rule('Archive/Text:ext=.txt,age>1d')]
+    
+    FileSorter(str(source), quiet=True, rules=rules).sort_files()
+    
+    assert sorted(read_tree(source)) == ['Archive/Text/old.txt', 'Archives/small.zip',
+                                         'Cold/big.zip', 'Documents/new.txt']
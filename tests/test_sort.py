@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+import file_sorter
+from file_sorter import CATEGORY_MARKER, FileSorter
+
+
+def test_recursive_run_skips_extension_folders_from_earlier_runs(make_files, read_tree):
+    source = make_files({'old.md': 'sorted before'})
+    FileSorter(str(source), quiet=True).sort_files()
+    assert (source / 'MD' / CATEGORY_MARKER).exists()
+    make_files({'notes/new.md': 'n', 'Misc/a.md': 'a'}, root=source)
+    sorter = FileSorter(str(source), quiet=True)
+    
+    sorter.sort_files_recursive()
+    
+    assert read_tree(source) == {'MD/old.md': 'sorted before', 'MD/new.md': 'n', 'MD/a.md': 'a'}
+    assert sorter.stats['dirs_pruned'] >= 1
+    assert ('dir', str(source / 'MD'), True) not in FileSorter(str(source))._shard_units(2, 'top')
+
+
+def test_recursive_run_sorts_upper_case_folders_of_the_user(make_files, read_tree):
+    source = make_files({'DCIM/photo.jpg': 'p', 'SRC/main.py': 'm', 'JSON/data.json': 'd'})
+    
+    FileSorter(str(source), quiet=True).sort_files_recursive()
+    
+    assert read_tree(source) == {'Images/photo.jpg': 'p', 'Code/main.py': 'm',
+                                 'JSON/data.json': 'd'}
+    assert not (source / 'Images' / CATEGORY_MARKER).exists()
+
+
+def test_sniffing_tells_iso_media_brands_apart(make_files, read_tree):
+    box = b'\x00\x00\x00\x18ftyp%s\x00\x00\x00\x00'
+    source = make_files({'photo': box % b'heic', 'cover': box % b'avif',
+                         'song': box % b'M4A ', 'clip': box % b'isom'})
+    
+    FileSorter(str(source), quiet=True, sniff=True).sort_files()
+    
+    assert sorted(read_tree(source)) == ['Audio/song', 'Images/cover', 'Images/photo', 'Videos/clip']
+
+
+def test_paths_starting_with_a_tilde_are_expanded(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    
+    sorter = FileSorter('~/Downloads', '~/Organized')
+    
+    assert sorter.source_dir == (tmp_path / 'Downloads').resolve()
+    assert sorter.target_dir == (tmp_path / 'Organized').resolve()
+
+
+@pytest.mark.parametrize('renameat2', [True, False])
+def test_rename_never_replaces_an_existing_file(tmp_path, monkeypatch, renameat2):
+    if not renameat2:
+        monkeypatch.setattr(file_sorter, '_renameat2', None)
+    elif file_sorter._renameat2 is None:
+        pytest.skip('renameat2 is not available')
+    (tmp_path / 'a').write_text('a')
+    (tmp_path / 'b').write_text('b')
+    sorter = FileSorter(str(tmp_path), quiet=True)
+    
+    with pytest.raises(FileExistsError):
+        sorter._rename_no_clobber(str(tmp_path / 'a'), str(tmp_path / 'b'))
+    sorter._rename_no_clobber(str(tmp_path / 'a'), str(tmp_path / 'c'))
+    
+    assert (tmp_path / 'b').read_text() == 'b'
+    assert (tmp_path / 'c').read_text() == 'a' and not (tmp_path / 'a').exists()
+
+
+@pytest.mark.skipif(file_sorter._renameat2 is None, reason='renameat2 is not available')
+def test_same_device_move_is_a_single_rename(make_files):
+    source = make_files({'a.txt': 'a'})
+    sorter = FileSorter(str(source), quiet=True, metrics=True)
+    
+    sorter.sort_files()
+    
+    syscalls = sorter.metrics.snapshot_syscalls()
+    assert syscalls['renameat2'] == 1 and 'link' not in syscalls
+    assert os.stat(str(source / 'Documents' / 'a.txt')).st_nlink == 1
+
+
+def test_full_shard_folders_spill_in_order(make_files, read_tree):
+    source = make_files({f'ab{n}.txt': str(n) for n in range(5)})
+    
+    FileSorter(str(source), quiet=True, layout='prefix', max_entries=2).sort_files()
+    
+    tree = read_tree(source)
+    assert sorted({path.rsplit('/', 1)[0] for path in tree}) == [
+        'Documents/ab', 'Documents/ab.1', 'Documents/ab.2']
+    assert sorted(tree.values()) == ['0', '1', '2', '3', '4']
+    
+    make_files({'abc.txt': 'late'}, root=source)
+    FileSorter(str(source), quiet=True, layout='prefix', max_entries=2).sort_files()
+    
+    assert read_tree(source)['Documents/ab.2/abc.txt'] == 'late'
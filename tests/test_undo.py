@@ -0,0 +1,107 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+import file_sorter
+from file_sorter import FileSorter, UndoLog
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'file_sorter.py')
+
+
+def sort_with_log(source, log):
+    sorter = FileSorter(str(source), quiet=True)
+    sorter.open_undo_log(str(log))
+    sorter.sort_files()
+    sorter.close_undo_log()
+    return sorter
+
+
+def test_undo_after_collision_renamed_sort(make_files, read_tree, tmp_path):
+    source = make_files({'a.txt': 'new', 'Documents/a.txt': 'already sorted'})
+    log = tmp_path / 'undo.log'
+    
+    sort_with_log(source, log)
+    assert read_tree(source) == {'Documents/a.txt': 'already sorted', 'Documents/a_1.txt': 'new'}
+    
+    FileSorter(str(source), quiet=True).undo(str(log))
+    
+    assert read_tree(source) == {'a.txt': 'new', 'Documents/a.txt': 'already sorted'}
+
+
+def test_undo_removes_emptied_folders_and_skips_conflicts(make_files, read_tree, tmp_path):
+    source = make_files({'a.jpg': 'a', 'b.pdf': 'b'})
+    log = tmp_path / 'undo.log'
+    
+    sort_with_log(source, log)
+    (source / 'b.pdf').write_text('taken again')
+    FileSorter(str(source), quiet=True).undo(str(log))
+    
+    assert read_tree(source) == {'a.jpg': 'a', 'b.pdf': 'taken again', 'Documents/b.pdf': 'b'}
+    assert not (source / 'Images').exists()
+
+
+def test_undo_removes_marked_extension_folders(make_files, read_tree, tmp_path):
+    source = make_files({'a.md': 'a'})
+    log = tmp_path / 'undo.log'
+    
+    sort_with_log(source, log)
+    FileSorter(str(source), quiet=True).undo(str(log))
+    
+    assert read_tree(source, include_hidden=True) == {'a.md': 'a'}
+    assert not (source / 'MD').exists()
+
+
+def test_run_that_moves_nothing_leaves_no_log(make_files, tmp_path):
+    source = make_files({})
+    log = tmp_path / 'undo.log'
+    
+    sort_with_log(source, log)
+    
+    assert not log.exists()
+
+
+def test_existing_log_is_kept_when_nothing_moves(tmp_path):
+    log = tmp_path / 'undo.log'
+    first = UndoLog(str(log), '/s', '/t')
+    first.record('/s/a.txt', '/t/Documents/a.txt')
+    first.close()
+    
+    UndoLog(str(log), '/s', '/t').close()
+    
+    assert UndoLog.read(str(log))[1] == [('/s/a.txt', '/t/Documents/a.txt')]
+
+
+def test_records_are_written_before_close(make_files, tmp_path, monkeypatch):
+    monkeypatch.setattr(file_sorter, 'UNDO_FLUSH_INTERVAL', 0)
+    source = make_files({'a.jpg': 'a', 'b.jpg': 'b'})
+    log = tmp_path / 'undo.log'
+    
+    sorter = FileSorter(str(source), quiet=True)
+    sorter.open_undo_log(str(log))
+    sorter.sort_files()
+    
+    assert len(UndoLog.read(str(log))[1]) == 2
+    sorter.close_undo_log()
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='needs POSIX signals')
+def test_sigterm_during_watch_keeps_the_log(make_files, tmp_path):
+    source = make_files({'a.jpg': 'a', 'b.jpg': 'b'})
+    log = tmp_path / 'undo.log'
+    process = subprocess.Popen([sys.executable, SCRIPT, '-s', str(source), '--watch', '--poll',
+                                '--undo-log', str(log)],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        deadline = time.monotonic() + 10
+        while not (source / 'Images' / 'b.jpg').exists() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(10) == 0, process.stderr.read()
+    finally:
+        process.kill()
+    
+    assert len(UndoLog.read(str(log))[1]) == 2
@@ -0,0 +1,23 @@
+import os
+import time
+
+from file_sorter import FileSorter, PollingWatcher
+
+
+def test_first_sweep_leaves_files_still_being_written(make_files, read_tree, monkeypatch):
+    source = make_files({'old.txt': 'done', 'fresh.txt': 'still writing'})
+    os.utime(str(source / 'old.txt'), (time.time() - 60, time.time() - 60))
+    seen = []
+    
+    def wait(self, timeout):
+        if seen:
+            raise KeyboardInterrupt
+        seen.append(read_tree(source))
+        time.sleep(timeout)
+        return []
+    
+    monkeypatch.setattr(PollingWatcher, 'wait', wait)
+    FileSorter(str(source), quiet=True).watch(debounce=0.3, use_inotify=False)
+    
+    assert seen == [{'Documents/old.txt': 'done', 'fresh.txt': 'still writing'}]
+    assert read_tree(source) == {'Documents/old.txt': 'done', 'Documents/fresh.txt': 'still writing'}